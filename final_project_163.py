@@ -3,6 +3,8 @@ import altair as alt
 import geopandas as gpd
 import matplotlib.pyplot as plt
 from geopandas import GeoDataFrame
+import final_project_processing_163
+import final_project_cache
 
 #### added to processing file ####
 def get_filtered_data(file_url):
@@ -11,12 +13,10 @@ def get_filtered_data(file_url):
     Reads url of CSV file into a pandas dataframe.
     Fills N/A values with 0, and filters for only
     relevant columns. Returns pandas dataframe.
+    The file is read through the local dataset cache.
     '''
-    df = pd.read_csv(file_url).fillna(0)
-    df_relevant = df[['iso_code', 'continent', 'location',
-                      'date', 'total_cases', 'total_vaccinations',
-                      'people_vaccinated', 'people_fully_vaccinated',
-                      'new_vaccinations', 'population', 'gdp_per_capita']]
+    df_relevant = final_project_processing_163.get_filtered_data(
+        file_url, cache_dir=final_project_cache.CACHE_DIR)
     return(df_relevant)
 
 #### non-plotting part added to processing file ####
@@ -0,0 +1,532 @@
+'''
+Matthew Friedrich
+CSE 163 Section AG
+
+This file contains the functions generate_owid_csv, benchmark,
+check_engines, run_benchmarks, and benchmark_imports.
+generate_owid_csv writes a synthetic dataset with the same columns
+as the COVID-19 dataset acquired from Our World in Data, at a
+multiple of its size, without downloading anything. check_engines
+compares the snapshot of the pandas and arrow engines on one file.
+benchmark times and measures the peak memory of each
+processing function in final_project_processing_163.py and each
+plotting function in final_project_plotting.py on one file, and
+run_benchmarks does so at several sizes and saves the results
+to a JSON file that can be compared across versions of the code.
+benchmark_imports times importing each project file in a fresh
+Python process, next to the heavy libraries it no longer loads.
+'''
+
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import string
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+import numpy as np
+import pandas as pd
+import final_project_processing_163
+import final_project_plotting
+import final_project_geometry
+
+
+# number of locations and days in the dataset used by the project,
+# a scale of 1 generates about as many rows
+BASE_LOCATIONS = 210
+BASE_DAYS = 420
+FIRST_DATE = '2020-01-01'
+
+# groups of countries in the dataset, by iso code
+AGGREGATES = {'OWID_WRL': 'World',
+              'OWID_AFR': 'Africa',
+              'OWID_ASI': 'Asia',
+              'OWID_EUR': 'Europe',
+              'OWID_EUN': 'European Union',
+              'OWID_INT': 'International',
+              'OWID_NAM': 'North America',
+              'OWID_OCE': 'Oceania',
+              'OWID_SAM': 'South America'}
+
+CONTINENTS = ['Africa', 'Asia', 'Europe', 'North America',
+              'Oceania', 'South America']
+
+# columns of the dataset that the project does not use, filled
+# with random numbers so reading them costs as much as it would
+OTHER_COLUMNS = ['new_cases', 'new_cases_smoothed', 'total_deaths',
+                 'new_deaths', 'new_deaths_smoothed',
+                 'total_cases_per_million', 'new_cases_per_million',
+                 'total_deaths_per_million', 'reproduction_rate',
+                 'icu_patients', 'hosp_patients', 'new_tests',
+                 'total_tests', 'positive_rate', 'tests_per_case',
+                 'new_vaccinations_smoothed',
+                 'total_vaccinations_per_hundred',
+                 'people_vaccinated_per_hundred', 'stringency_index',
+                 'population_density', 'median_age', 'aged_65_older',
+                 'extreme_poverty', 'cardiovasc_death_rate',
+                 'diabetes_prevalence', 'hospital_beds_per_thousand',
+                 'life_expectancy', 'human_development_index']
+
+# project files timed by benchmark_imports, then the libraries they
+# only load when a map or plot is drawn
+IMPORT_MODULES = ['final_project_processing_163', 'final_project_geometry',
+                  'final_project_plotting', 'geopandas', 'altair',
+                  'matplotlib.pyplot']
+HEAVY_MODULES = ['geopandas', 'altair', 'matplotlib']
+
+# run in a fresh process, prints the seconds to import the module and
+# the heavy libraries it loaded
+IMPORT_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(seconds, *[name for name in {heavy!r} if name in sys.modules])
+'''
+
+# processing functions after get_snapshot, each taking the filtered
+# data, the snapshot and the country index built once before them,
+# as the plotting script passes them
+PROCESSING = {
+    'get_q1_df': lambda data, snapshot, country_index:
+        final_project_processing_163.get_q1_df(
+            data, snapshot, country_index=country_index),
+    'get_q2_map_df': lambda data, snapshot, country_index:
+        final_project_processing_163.get_q2_map_df(
+            data, snapshot, country_index=country_index),
+    'get_q3_xy_df': lambda data, snapshot, country_index:
+        final_project_processing_163.get_q3_xy_df(
+            data, snapshot, country_index=country_index),
+    'get_q3_map_df': lambda data, snapshot, country_index:
+        final_project_processing_163.get_q3_map_df(
+            data, country_index=country_index)}
+
+# engines of get_filtered_data and get_snapshot that can be compared
+ENGINES = ['pandas', 'arrow']
+
+# plotting functions, each with the processing function it takes
+PLOTTING = {'get_q1_plot': 'get_q1_df',
+            'get_q2_plot': 'get_q2_map_df',
+            'get_q3_xy_plot': 'get_q3_xy_df',
+            'get_q3_map_plot': 'get_q3_map_df'}
+
+
+def generate_owid_csv(path, scale=1, seed=0):
+    '''
+    Takes path of the CSV file to write as a parameter, and optionally
+    the size as a multiple of the real dataset and a random seed.
+    Writes a dataset with the columns of the Our World in Data file.
+    Countries start vaccinating on a random day and then skip
+    reporting on some days, some never report people vaccinated,
+    and some have no population or GDP per capita, so the
+    processing functions meet the same zero and N/A patterns as in
+    the real data. Groups of countries such as OWID_WRL are
+    included. Returns the number of rows written.
+    '''
+    rng = np.random.default_rng(seed)
+    countries = int(BASE_LOCATIONS * scale)
+    days = BASE_DAYS
+
+    # codes of the country shapes when they can be loaded, so the maps
+    # have countries to draw, then letter codes in order, long enough
+    # that every country has its own code
+    codes = list(pd.unique(np.array(_get_shape_codes(), dtype=object)))
+    codes = [code for code in codes if code not in AGGREGATES][:countries]
+    length = 3
+    while len(string.ascii_uppercase) ** length < countries + len(codes):
+        length += 1
+    taken = set(codes)
+    letter_codes = (''.join(letters) for letters in itertools.product(
+        string.ascii_uppercase, repeat=length))
+    codes += itertools.islice((code for code in letter_codes
+                               if code not in taken),
+                              countries - len(codes))
+    codes = sorted(codes)
+    assert len(set(codes)) == countries, 'country codes are not unique'
+    iso_codes = np.array(codes + list(AGGREGATES), dtype=object)
+    locations = np.array(['Country ' + code for code in codes] +
+                         list(AGGREGATES.values()), dtype=object)
+    continents = np.array(list(rng.choice(CONTINENTS, size=len(codes))) +
+                          [None] * len(AGGREGATES), dtype=object)
+    count = len(iso_codes)
+
+    # attributes of each location
+    population = np.exp(rng.uniform(np.log(1e4), np.log(1.4e9), count))
+    population[rng.random(count) < 0.03] = np.nan
+    gdp = np.exp(rng.uniform(np.log(600), np.log(120000), count))
+    gdp[rng.random(count) < 0.1] = np.nan
+    gdp[-len(AGGREGATES):] = np.nan
+    first_case = rng.integers(0, 90, count)
+    first_dose = rng.integers(330, days + 60, count)
+    reports_people = rng.random(count) < 0.8
+
+    # one row for each location and day
+    row_location = np.repeat(np.arange(count), days)
+    row_day = np.tile(np.arange(days), count)
+    dates = pd.date_range(FIRST_DATE, periods=days).strftime('%Y-%m-%d')
+
+    cases_per_day = rng.uniform(1e-5, 5e-4, count)[row_location] * \
+        np.nan_to_num(population, nan=1e6)[row_location]
+    total_cases = np.floor((row_day - first_case[row_location]) *
+                           cases_per_day)
+    total_cases[row_day < first_case[row_location]] = np.nan
+
+    # doses grow after the first day of vaccinating, with gaps
+    vaccinating = row_day >= first_dose[row_location]
+    rate = rng.uniform(0.001, 0.012, count)[row_location]
+    total_vaccinations = np.floor(
+        np.nan_to_num(population, nan=1e6)[row_location] * rate *
+        (row_day - first_dose[row_location] + 1))
+    reported = vaccinating & (rng.random(len(row_day)) < 0.6)
+    total_vaccinations[~reported] = np.nan
+    people_vaccinated = np.floor(total_vaccinations * 0.7)
+    people_vaccinated[~reports_people[row_location]] = np.nan
+    people_vaccinated[rng.random(len(row_day)) < 0.2] = np.nan
+    people_fully_vaccinated = np.floor(people_vaccinated * 0.35)
+    new_vaccinations = np.floor(np.nan_to_num(population,
+                                              nan=1e6)[row_location] * rate)
+    new_vaccinations[~reported] = np.nan
+
+    df = pd.DataFrame({'iso_code': iso_codes[row_location],
+                       'continent': continents[row_location],
+                       'location': locations[row_location],
+                       'date': dates[row_day],
+                       'total_cases': total_cases,
+                       'total_vaccinations': total_vaccinations,
+                       'people_vaccinated': people_vaccinated,
+                       'people_fully_vaccinated': people_fully_vaccinated,
+                       'new_vaccinations': new_vaccinations,
+                       'population': population[row_location],
+                       'gdp_per_capita': gdp[row_location]})
+    for column in OTHER_COLUMNS:
+        values = np.round(rng.random(len(df)) * 100, 3)
+        values[rng.random(len(df)) < 0.5] = np.nan
+        df[column] = values
+
+    assert len(df) == (countries + len(AGGREGATES)) * days, \
+        'row count does not match the scale'
+    df.to_csv(path, index=False)
+    return(len(df))
+
+
+def _get_shape_codes():
+    '''
+    Returns list of the iso codes of the country shapes, or an empty
+    list if the shapes cannot be loaded.
+    '''
+    try:
+        world = final_project_geometry.get_world()
+    except Exception:
+        return([])
+    return([code for code in world['iso_a3'] if code != '-99'])
+
+
+def benchmark(file_url, repeat=3, compact=False, engine='pandas'):
+    '''
+    Takes url of a COVID-19 CSV file as a parameter, and optionally
+    the number of times to run each function, and the compact option
+    and engine of get_filtered_data. Times each processing and
+    plotting function, keeping the fastest run, and measures its peak
+    memory, and that of Arrow, in one more run. The processing
+    functions share one country index and snapshot. Functions that fail,
+    such as the maps when the country shapes are not available, are
+    recorded with their error. Returns list of dictionaries, one for
+    each function.
+    '''
+    with warnings.catch_warnings():
+        # countries without a shape are expected in generated data
+        warnings.simplefilter('ignore')
+        return(_benchmark(file_url, repeat, compact, engine))
+
+
+def _benchmark(file_url, repeat, compact, engine):
+    '''
+    Takes the parameters of benchmark. Returns the results of benchmark.
+    '''
+    results = []
+    outputs = {}
+
+    data = _measure(results, 'get_filtered_data', repeat,
+                    lambda: final_project_processing_163.get_filtered_data(
+                        file_url, compact=compact, engine=engine))
+    if data is None:
+        return(results)
+    results[-1]['rows'] = len(data)
+    # the functions after them build their own index and snapshot if
+    # these failed
+    country_index = _measure(
+        results, 'get_country_index', repeat,
+        lambda: final_project_processing_163.get_country_index(data))
+    snapshot = _measure(results, 'get_snapshot', repeat,
+                        lambda: final_project_processing_163.get_snapshot(
+                            data, country_index, engine=engine))
+
+    for name, function in PROCESSING.items():
+        outputs[name] = _measure(
+            results, name, repeat,
+            lambda: function(data, snapshot, country_index))
+
+    for name, processing_name in PLOTTING.items():
+        df = outputs[processing_name]
+        if df is None:
+            continue
+        plot_function = getattr(final_project_plotting, name)
+        _measure(results, name, repeat,
+                 lambda: _draw(plot_function(df)))
+
+    return(results)
+
+
+def _measure(results, name, repeat, function):
+    '''
+    Takes list of results, name of a function, number of times to run
+    it, and the function itself with no parameters as parameters.
+    Adds a dictionary with its fastest time in seconds and peak memory
+    in bytes to the results, or with the error if it failed. Memory
+    allocated by Arrow, which tracemalloc does not see, is added as
+    its own peak when PyArrow is installed. Returns the output of the
+    function, or None if it failed.
+    '''
+    result = {'function': name}
+    results.append(result)
+    try:
+        seconds = []
+        for run in range(repeat):
+            start = time.perf_counter()
+            output = function()
+            seconds.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        with _arrow_pool() as pool:
+            function()
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if pool is not None:
+            result['arrow_peak_bytes'] = pool.max_memory()
+    except Exception as error:
+        tracemalloc.stop()
+        result['error'] = type(error).__name__ + ': ' + str(error)
+        return(None)
+    result['seconds'] = min(seconds)
+    return(output)
+
+
+@contextlib.contextmanager
+def _arrow_pool():
+    '''
+    Makes Arrow allocate through a new memory pool, which passes the
+    allocations on to the default pool while keeping its own peak,
+    until the with block ends. Yields the pool, or None if PyArrow is
+    not installed.
+    '''
+    try:
+        import pyarrow as pa
+    except ImportError:
+        yield None
+        return
+    default_pool = pa.default_memory_pool()
+    pool = pa.proxy_memory_pool(default_pool)
+    pa.set_memory_pool(pool)
+    try:
+        yield pool
+    finally:
+        pa.set_memory_pool(default_pool)
+
+
+def check_engines(file_url, compact=False):
+    '''
+    Takes url of a COVID-19 CSV file as a parameter, and optionally
+    the compact option of get_filtered_data. Reads the file and builds
+    the snapshot with each engine in ENGINES. Files larger than one
+    block of the Arrow reader, such as any generated file of scale 1
+    or more, are read in several chunks, which the arrow engine has to
+    join. Returns list of the problems found, such as an engine that
+    failed or a snapshot column that differs from the pandas engine,
+    empty if the engines agree.
+    '''
+    problems = []
+    snapshots = {}
+    for engine in ENGINES:
+        try:
+            data = final_project_processing_163.get_filtered_data(
+                file_url, compact=compact, engine=engine)
+            snapshots[engine] = final_project_processing_163.get_snapshot(
+                data, engine=engine)
+        except Exception as error:
+            problems.append(engine + ' failed: ' + type(error).__name__ +
+                            ': ' + str(error))
+    expected = snapshots.get('pandas')
+    if expected is None:
+        return(problems)
+    for engine, snapshot in snapshots.items():
+        if len(snapshot) != len(expected):
+            problems.append('%s has %d countries, not %d' % (
+                engine, len(snapshot), len(expected)))
+            continue
+        for column in expected.columns:
+            if not _same_values(expected[column], snapshot[column]):
+                problems.append(engine + ' differs in ' + column)
+    return(problems)
+
+
+def _same_values(expected, values):
+    '''
+    Takes two pandas series of any dtypes as parameters. Returns True
+    if they hold the same values in the same order, numbers compared
+    as floats and everything else as text. Missing text is compared
+    as empty, as is the 0 the default pandas mode fills it with.
+    '''
+    if pd.api.types.is_numeric_dtype(expected.dtype):
+        return(bool(np.allclose(expected.astype(float).to_numpy(),
+                                values.astype(float).to_numpy(),
+                                equal_nan=True)))
+    expected, values = [series.astype(object).where(
+        series.notna() & (series.astype(object) != 0), '').astype(str)
+        for series in (expected, values)]
+    return(list(expected) == list(values))
+
+
+def _draw(plot):
+    '''
+    Takes Altair or Matplotlib plot as a parameter. Renders it to
+    memory the same way main saves it to a file.
+    '''
+    if hasattr(plot, 'savefig'):
+        import matplotlib.pyplot as plt
+        plot.savefig(io.BytesIO())
+        plt.close(plot)
+    else:
+        plot.to_html()
+
+
+def run_benchmarks(scales=(1, 10, 100), directory='benchmark_data',
+                   output='benchmark_results.json', repeat=3,
+                   compact=False, engines=('pandas',)):
+    '''
+    Takes optionally the sizes to benchmark as multiples of the real
+    dataset, the directory for the generated files, the path of the
+    JSON results file, the number of times to run each function, the
+    compact option of get_filtered_data, and the engines from ENGINES
+    to compare. Generates a dataset of each size once, benchmarks it
+    with each engine, and writes all results with the library
+    versions used. When several engines are compared, also checks
+    with check_engines that their snapshots agree. Returns dictionary
+    of the results.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'pandas': pd.__version__,
+              'pyarrow': _get_version('pyarrow'),
+              'compact': compact,
+              'runs': [],
+              'engine_checks': []}
+    for scale in scales:
+        path = os.path.join(directory, 'owid-scale-%g.csv' % scale)
+        if not os.path.exists(path):
+            generate_owid_csv(path, scale)
+        if len(engines) > 1:
+            report['engine_checks'].append({
+                'scale': scale,
+                'problems': check_engines(path, compact)})
+        for engine in engines:
+            report['runs'].append({'scale': scale,
+                                   'engine': engine,
+                                   'file_bytes': os.path.getsize(path),
+                                   'results': benchmark(path, repeat,
+                                                        compact, engine)})
+            with open(output, 'w') as file:
+                json.dump(report, file, indent=2)
+    return(report)
+
+
+def _get_version(module):
+    '''
+    Takes name of a module as a parameter. Returns its version, or
+    None if it is not installed.
+    '''
+    try:
+        return(__import__(module).__version__)
+    except ImportError:
+        return(None)
+
+
+def benchmark_imports(modules=IMPORT_MODULES, repeat=5):
+    '''
+    Takes optionally list of module names and the number of times to
+    import each as parameters. Imports each module in a new Python
+    process, after numpy and pandas which every file needs, keeping
+    the fastest run. Returns list of dictionaries with the seconds
+    each took and the heavy libraries, such as geopandas, it loaded.
+    '''
+    results = []
+    for module in modules:
+        script = 'import numpy, pandas\n' + IMPORT_SCRIPT.format(
+            module=module, heavy=HEAVY_MODULES)
+        seconds = []
+        for run in range(repeat):
+            output = subprocess.run([sys.executable, '-c', script],
+                                    capture_output=True, text=True,
+                                    cwd=os.path.dirname(
+                                        os.path.abspath(__file__)))
+            if output.returncode != 0:
+                break
+            words = output.stdout.split()
+            seconds.append(float(words[0]))
+        result = {'module': module}
+        if len(seconds) == 0:
+            result['error'] = output.stderr.strip().splitlines()[-1]
+        else:
+            result['seconds'] = min(seconds)
+            result['loaded'] = words[1:]
+        results.append(result)
+    return(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the processing and plotting functions.')
+    parser.add_argument('--scales', type=float, nargs='+',
+                        default=[1, 10, 100])
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--compact', action='store_true')
+    parser.add_argument('--engine', choices=ENGINES + ['both'],
+                        default='pandas',
+                        help='engine of get_filtered_data, or both to '
+                             'compare them')
+    parser.add_argument('--imports', action='store_true',
+                        help='only time importing each file')
+    args = parser.parse_args()
+    if args.imports:
+        for result in benchmark_imports(repeat=args.repeat):
+            print(result['module'],
+                  round(result.get('seconds', float('nan')), 4),
+                  ' '.join(result.get('loaded', [])) or
+                  result.get('error', ''))
+        return
+    engines = ENGINES if args.engine == 'both' else [args.engine]
+    report = run_benchmarks(args.scales, output=args.output,
+                            repeat=args.repeat, compact=args.compact,
+                            engines=engines)
+    for run in report['runs']:
+        for result in run['results']:
+            print(run['scale'], run['engine'], result['function'],
+                  round(result.get('seconds', float('nan')), 4),
+                  result.get('peak_bytes', result.get('error')),
+                  result.get('arrow_peak_bytes', ''))
+    for check in report['engine_checks']:
+        print(check['scale'], 'engines agree' if not check['problems']
+              else '; '.join(check['problems']))
+
+
+if __name__ == "__main__":
+    main()
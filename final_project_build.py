@@ -0,0 +1,182 @@
+'''
+Matthew Friedrich
+CSE 163 Section AG
+
+This file contains the functions get_fingerprints and build, and
+a main function to run build from the command line. build works
+like make for the plots of final_project_plotting.py: it
+fingerprints the inputs of each output (the hash of the dataset,
+its parameters, the version of the country shapes and the code
+that processes and plots it), stores the processed data of each
+output, and only processes or plots again the outputs whose inputs
+changed since the last build. For example,
+
+    python final_project_build.py --only q2
+
+rebuilds only q2_map.png, and only if it is out of date.
+'''
+
+
+import argparse
+import hashlib
+import json
+import os
+import pandas as pd
+import final_project_cache
+import final_project_geometry
+import final_project_plotting
+import final_project_processing_163
+
+
+DATA_URL = ('https://covid.ourworldindata.org/data/'
+            'owid-covid-data.csv?v=2021-02-17')
+
+# source files each step depends on
+PROCESSING_FILES = [final_project_processing_163.__file__,
+                    final_project_geometry.__file__,
+                    final_project_cache.__file__]
+PLOTTING_FILES = [final_project_plotting.__file__,
+                  final_project_geometry.__file__]
+
+# outputs drawn on the country shapes
+MAP_OUTPUTS = ['q2', 'q3_map']
+
+# build parameters each output is processed with, outputs not listed
+# use none
+OUTPUT_PARAMS = {'q1': ['q1_points']}
+
+
+def get_fingerprints(output, digest, params):
+    '''
+    Takes output name from OUTPUTS in final_project_plotting.py, the
+    hash of the dataset and a dictionary of the build parameters as
+    parameters. Returns tuple of the fingerprint of the processed data
+    of the output and the fingerprint of its plot, each a hash of
+    everything they are built from, including only the parameters in
+    OUTPUT_PARAMS for the output.
+    '''
+    inputs = {'output': output,
+              'dataset': digest,
+              'params': {name: params[name]
+                         for name in OUTPUT_PARAMS.get(output, [])},
+              'code': _hash_files(PROCESSING_FILES)}
+    if output in MAP_OUTPUTS:
+        inputs['geometry'] = final_project_geometry.WORLD_VERSION
+    processed = _hash_json(inputs)
+    plotted = _hash_json({'processed': processed,
+                          'code': _hash_files(PLOTTING_FILES)})
+    return(processed, plotted)
+
+
+def build(outputs=None, file_url=DATA_URL,
+          cache_dir=final_project_cache.CACHE_DIR, force=False,
+          q1_points=None):
+    '''
+    Takes optionally a list of output names from OUTPUTS in
+    final_project_plotting.py, the url of the dataset, the cache
+    directory, whether to rebuild everything, and the number of points
+    to downsample each country of the q1 plot to. Processes the data
+    of each out of date output, or loads it when only its plot is out
+    of date, and saves the plots of those outputs. Returns dictionary
+    from each output name to 'rebuilt' or 'up to date'.
+    '''
+    if outputs is None:
+        outputs = list(final_project_plotting.OUTPUTS)
+    params = {'q1_points': q1_points}
+    state_path = os.path.join(cache_dir, 'build.json')
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as file:
+            state = json.load(file)
+
+    path, digest = final_project_cache.fetch_file(file_url, cache_dir)
+
+    # outputs whose plot is missing or was built from other inputs
+    fingerprints = {output: get_fingerprints(output, digest, params)
+                    for output in outputs}
+    stale = [output for output in outputs
+             if force or not os.path.exists(
+                 final_project_plotting.OUTPUTS[output]) or
+             state.get(output) != fingerprints[output][1]]
+
+    # processed data of stale outputs, from the last build when its
+    # inputs are the same
+    output_dfs = {}
+    to_process = []
+    for output in stale:
+        processed_path = _processed_path(cache_dir, fingerprints[output][0])
+        if not force and os.path.exists(processed_path):
+            output_dfs[output] = pd.read_pickle(processed_path)
+        else:
+            to_process.append(output)
+
+    if len(to_process) > 0:
+        data = final_project_processing_163.get_filtered_data(
+            file_url, cache_dir=cache_dir)
+        processed = final_project_plotting.get_output_dfs(
+            data, to_process, q1_points)
+        for output, df in processed.items():
+            processed_path = _processed_path(cache_dir,
+                                             fingerprints[output][0])
+            os.makedirs(os.path.dirname(processed_path), exist_ok=True)
+            df.to_pickle(processed_path)
+        output_dfs.update(processed)
+
+    if len(output_dfs) > 0:
+        final_project_plotting.render_output_dfs(output_dfs)
+        for output in output_dfs:
+            state[output] = fingerprints[output][1]
+        final_project_cache.save_json(state, state_path)
+
+    return({output: 'rebuilt' if output in stale else 'up to date'
+            for output in outputs})
+
+
+def _processed_path(cache_dir, fingerprint):
+    '''
+    Takes the cache directory and the fingerprint of processed data as
+    parameters. Returns path the processed data is stored at.
+    '''
+    return(os.path.join(cache_dir, 'build', fingerprint + '.pkl'))
+
+
+def _hash_files(paths):
+    '''
+    Takes list of file paths as a parameter. Returns hash of the
+    contents of all the files.
+    '''
+    sha = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as file:
+            sha.update(file.read())
+    return(sha.hexdigest())
+
+
+def _hash_json(value):
+    '''
+    Takes a value that can be written as JSON as a parameter. Returns
+    hash of its JSON text.
+    '''
+    text = json.dumps(value, sort_keys=True)
+    return(hashlib.sha256(text.encode()).hexdigest())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Rebuild the plots whose inputs changed.')
+    parser.add_argument('--only', action='append',
+                        choices=list(final_project_plotting.OUTPUTS),
+                        help='output to build, can be given more than once')
+    parser.add_argument('--url', default=DATA_URL)
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild even if nothing changed')
+    parser.add_argument('--q1-points', type=int)
+    args = parser.parse_args()
+    results = build(args.only, args.url, force=args.force,
+                    q1_points=args.q1_points)
+    for output, result in results.items():
+        print(final_project_plotting.OUTPUTS[output], result)
+
+
+if __name__ == "__main__":
+    main()
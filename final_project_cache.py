@@ -0,0 +1,368 @@
+'''
+Matthew Friedrich
+CSE 163 Section AG
+
+This file contains the functions fetch_file, get_frame_path,
+load_frame, save_frame, dump_columns, load_columns, and save_json.
+They form a local cache for the
+COVID-19 dataset acquired from Our World in Data, used by
+get_filtered_data in final_project_processing_163.py.
+Each fetched file is stored by the hash of its contents and
+revalidated with ETag / Last-Modified headers, so it is only
+downloaded again when it changes. Parsed dataframes are stored
+next to it as binary columnar files, so later runs do not need
+to parse the CSV again. dump_columns and load_columns store a
+dataframe as one raw numpy file per column, which is opened with
+memory mapping, so short lived processes and parallel workers
+can use the data without parsing it or copying its number and
+categorical columns. save_json writes small state files, such as
+the index of fetched files, atomically.
+'''
+
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import urllib.error
+import urllib.request
+import numpy as np
+import pandas as pd
+
+
+# default directory for the cache, relative to where the code is run
+CACHE_DIR = '.owid_cache'
+
+# size of blocks read while downloading and hashing files
+BLOCK_SIZE = 1 << 20
+
+
+def fetch_file(file_url, cache_dir=CACHE_DIR):
+    '''
+    Takes url or local path of a file and the cache directory as
+    parameters. Downloads the file into the cache, stored under the
+    hash of its contents, unless the cached copy is still valid.
+    Remote files are revalidated with the ETag and Last-Modified
+    headers from the last download. Local files are revalidated
+    with their size and modification time and are not copied.
+    Returns tuple of the local path of the file and its hash.
+    '''
+    index = _read_index(cache_dir)
+    entry = index.get(file_url)
+
+    if os.path.exists(file_url):
+        stat = os.stat(file_url)
+        validators = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        if entry is None or entry['validators'] != validators:
+            with open(file_url, 'rb') as file:
+                digest = _hash_stream(file)
+            entry = {'digest': digest, 'validators': validators}
+            index[file_url] = entry
+            _write_index(cache_dir, index)
+        return(file_url, entry['digest'])
+
+    request = urllib.request.Request(file_url)
+    if entry is not None and _object_path(cache_dir, entry) is not None:
+        if entry['validators'].get('etag'):
+            request.add_header('If-None-Match',
+                               entry['validators']['etag'])
+        if entry['validators'].get('last_modified'):
+            request.add_header('If-Modified-Since',
+                               entry['validators']['last_modified'])
+
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as error:
+        # cached copy is still the latest version
+        if error.code == 304:
+            return(_object_path(cache_dir, entry), entry['digest'])
+        raise
+
+    with response:
+        objects_dir = os.path.join(cache_dir, 'objects')
+        os.makedirs(objects_dir, exist_ok=True)
+        # hash while downloading, then move into place under the hash
+        with tempfile.NamedTemporaryFile(dir=objects_dir,
+                                         delete=False) as temp:
+            digest = _hash_stream(response, temp)
+        validators = {'etag': response.headers.get('ETag'),
+                      'last_modified': response.headers.get('Last-Modified')}
+
+    entry = {'digest': digest, 'validators': validators}
+    path = os.path.join(objects_dir, digest + '.csv')
+    if os.path.exists(path):
+        os.remove(temp.name)
+    else:
+        os.replace(temp.name, path)
+    index[file_url] = entry
+    _write_index(cache_dir, index)
+    return(path, digest)
+
+
+def get_frame_path(cache_dir, digest, mode):
+    '''
+    Takes the cache directory, the hash of a fetched file and the
+    name of the mode it was parsed with as parameters. Returns the
+    path, without extension, of the binary copy of the dataframe.
+    '''
+    return(os.path.join(cache_dir, 'frames', digest + '-' + mode))
+
+
+def load_frame(frame_path):
+    '''
+    Takes path of a binary copy from get_frame_path as a parameter.
+    Reads it from Parquet, or from a pickle when the dataframe could
+    not be stored as Parquet. Returns pandas dataframe, or None if
+    there is no binary copy yet.
+    '''
+    if os.path.exists(frame_path + '.parquet'):
+        return(pd.read_parquet(frame_path + '.parquet'))
+    if os.path.exists(frame_path + '.pkl'):
+        return(pd.read_pickle(frame_path + '.pkl'))
+    return(None)
+
+
+def save_frame(df, frame_path):
+    '''
+    Takes pandas dataframe and path from get_frame_path as parameters.
+    Stores the dataframe as Parquet. Dataframes that Parquet cannot
+    store, such as columns mixing numbers and strings, or a missing
+    Parquet engine, fall back to a pickle.
+    '''
+    os.makedirs(os.path.dirname(frame_path), exist_ok=True)
+    try:
+        _save_atomic(frame_path + '.parquet',
+                     lambda path: df.to_parquet(path, index=False))
+    except (ImportError, TypeError, ValueError):
+        _save_atomic(frame_path + '.pkl', df.to_pickle)
+
+
+def dump_columns(df, directory):
+    '''
+    Takes pandas dataframe from get_filtered_data and a directory as
+    parameters. Sorts the rows by country, keeping the order of days,
+    and writes each column to the directory as a raw numpy file. Text
+    and categorical columns are written as integer codes, with their
+    values in a small dictionary. Also writes the offset of the first
+    row of each country, so one country can be read as a slice. The
+    files are written to a new directory next to it, which then
+    replaces the directory, so other processes never open columns
+    that are still being written.
+    '''
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=parent,
+                                prefix=os.path.basename(directory) + '.')
+    try:
+        _write_columns(df, temp_dir)
+        _replace_directory(temp_dir, directory)
+    finally:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+
+def _write_columns(df, directory):
+    '''
+    Takes pandas dataframe from get_filtered_data and an empty
+    directory as parameters. Writes the files of dump_columns to it.
+    '''
+
+    # rows of each country next to each other, countries in the order
+    # they first appear, so data already grouped keeps its order
+    country_codes, countries = pd.factorize(df['iso_code'].astype(object))
+    order = np.argsort(country_codes, kind='stable')
+    offsets = np.searchsorted(country_codes[order],
+                              np.arange(len(countries) + 1))
+    countries = list(countries)
+
+    meta = {'columns': [], 'rows': len(df), 'countries': countries}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) or \
+                values.dtype == object or pd.api.types.is_string_dtype(
+                    values.dtype):
+            categories, codes = _get_categories(values)
+            meta['columns'].append({
+                'name': column,
+                'kind': 'category' if isinstance(
+                    values.dtype, pd.CategoricalDtype) else 'text',
+                'categories': categories})
+            array = codes[order]
+        else:
+            meta['columns'].append({'name': column,
+                                    'kind': 'numbers',
+                                    'dtype': str(values.dtype)})
+            array = values.to_numpy()[order]
+        np.save(os.path.join(directory, column + '.npy'), array)
+
+    np.save(os.path.join(directory, 'offsets.npy'), offsets)
+    with open(os.path.join(directory, 'meta.json'), 'w') as file:
+        json.dump(meta, file)
+
+
+def _replace_directory(temp_dir, directory):
+    '''
+    Takes a new directory and the path it should have as parameters.
+    Moves the new directory into place. A directory can only be
+    replaced by renaming when it is empty, so an existing one is first
+    moved aside and removed. If another process puts its copy in place
+    at the same time, that copy is kept.
+    '''
+    try:
+        os.replace(temp_dir, directory)
+        return
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+
+    old_dir = tempfile.mkdtemp(dir=os.path.dirname(temp_dir),
+                               prefix=os.path.basename(directory) + '.old.')
+    try:
+        try:
+            os.replace(directory, os.path.join(old_dir, 'columns'))
+        except FileNotFoundError:
+            # another process moved it aside first
+            pass
+        try:
+            os.replace(temp_dir, directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    finally:
+        shutil.rmtree(old_dir)
+
+
+def load_columns(directory):
+    '''
+    Takes a directory written by dump_columns as a parameter. Opens
+    each column with memory mapping instead of reading it, so number
+    and categorical columns are not copied. Text columns are looked up
+    from their dictionary. Returns tuple of the pandas dataframe and a
+    dictionary from each country iso code to the slice of its rows.
+    '''
+    with open(os.path.join(directory, 'meta.json')) as file:
+        meta = json.load(file)
+
+    columns = {}
+    for column in meta['columns']:
+        array = np.load(os.path.join(directory, column['name'] + '.npy'),
+                        mmap_mode='r')
+        if column['kind'] == 'numbers':
+            columns[column['name']] = array
+        elif column['kind'] == 'category':
+            columns[column['name']] = pd.Categorical.from_codes(
+                array, column['categories'])
+        else:
+            # text is looked up from the dictionary, -1 is missing
+            categories = np.array(column['categories'] + [np.nan],
+                                  dtype=object)
+            columns[column['name']] = categories[array]
+    df = pd.DataFrame(columns, copy=False)
+
+    offsets = np.load(os.path.join(directory, 'offsets.npy'))
+    country_slices = {country: slice(int(offsets[position]),
+                                     int(offsets[position + 1]))
+                      for position, country in enumerate(meta['countries'])}
+    return(df, country_slices)
+
+
+def _get_categories(values):
+    '''
+    Takes pandas series of text or categories as a parameter. Returns
+    tuple of the list of its distinct values and a numpy array of the
+    position of each row's value in that list, using the smallest
+    integer type that fits, with -1 for missing values.
+    '''
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        categories = values.cat.categories
+    else:
+        codes, categories = pd.factorize(values)
+    categories = [category.item() if hasattr(category, 'item')
+                  else category for category in categories]
+    dtype = np.int8 if len(categories) < 1 << 7 else \
+        np.int16 if len(categories) < 1 << 15 else np.int32
+    return(categories, codes.astype(dtype))
+
+
+def save_json(value, path):
+    '''
+    Takes a value that can be written as JSON and the path of a file
+    as parameters. Writes the value to the file atomically, so readers
+    see either the old or the new file, never a partial one.
+    '''
+    def write(temp_path):
+        with open(temp_path, 'w') as file:
+            json.dump(value, file, indent=2)
+
+    _save_atomic(path, write)
+
+
+def _save_atomic(path, write):
+    '''
+    Takes path and a function that writes a file to a given path as
+    parameters. Writes to a temporary file first and moves it into
+    place, so an interrupted run never leaves a partial file. Each
+    call has its own temporary file, so parallel workers saving the
+    same file do not remove each other's.
+    '''
+    descriptor, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.',
+        prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(descriptor)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _hash_stream(stream, copy_to=None):
+    '''
+    Takes a binary stream, and optionally a file to copy it to, as
+    parameters. Reads the stream in blocks. Returns the SHA-256 hash
+    of its contents.
+    '''
+    sha = hashlib.sha256()
+    block = stream.read(BLOCK_SIZE)
+    while block:
+        sha.update(block)
+        if copy_to is not None:
+            copy_to.write(block)
+        block = stream.read(BLOCK_SIZE)
+    return(sha.hexdigest())
+
+
+def _object_path(cache_dir, entry):
+    '''
+    Takes the cache directory and an index entry as parameters.
+    Returns path of the cached file for the entry, or None if it
+    is missing.
+    '''
+    path = os.path.join(cache_dir, 'objects', entry['digest'] + '.csv')
+    if os.path.exists(path):
+        return(path)
+    return(None)
+
+
+def _read_index(cache_dir):
+    '''
+    Takes the cache directory as a parameter. Returns dictionary
+    from each fetched url to its hash and validators.
+    '''
+    path = os.path.join(cache_dir, 'index.json')
+    if not os.path.exists(path):
+        return({})
+    with open(path) as file:
+        return(json.load(file))
+
+
+def _write_index(cache_dir, index):
+    '''
+    Takes the cache directory and the dictionary from _read_index
+    as parameters. Writes the index to the cache directory.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    save_json(index, os.path.join(cache_dir, 'index.json'))
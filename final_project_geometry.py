@@ -0,0 +1,292 @@
+'''
+Matthew Friedrich
+CSE 163 Section AG
+
+This file contains the functions get_world, get_tolerance,
+get_world_index, get_shape_rows, get_world_paths,
+get_unmatched_countries, and join_world. get_world loads the
+country shapes used by the maps in final_project_processing_163.py
+and final_project_plotting.py. The shapes are loaded once per
+process, their iso codes are reconciled with the codes in the
+COVID-19 dataset acquired from Our World in Data, and a ready to
+join copy is stored on disk so later runs skip both steps.
+The other functions join country data to the shapes through an
+index from iso code to row positions, built once per process.
+Simplified copies of the shapes are stored for each level in
+SIMPLIFY_TOLERANCES, and get_tolerance picks the level whose
+detail is smaller than one pixel of a figure.
+get_world_paths keeps the shapes as Matplotlib paths, so the grey
+base layer of each map is built without converting them again.
+geopandas is only imported when shapes are first needed, so
+importing this file is cheap for callers that never draw a map.
+'''
+
+
+import functools
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import final_project_cache
+import final_project_timing
+
+
+# version of the stored shapes, increase when get_world changes them
+WORLD_VERSION = 1
+
+# columns of the country shapes used by the maps
+WORLD_COLUMNS = ['name', 'iso_a3', 'geometry']
+
+# iso codes missing from the shapes, or different from the
+# codes used by Our World in Data, by country name
+ISO_FIXES = {'Norway': 'NOR',
+             'France': 'FRA',
+             'N. Cyprus': 'OWID_NCY',
+             'Somaliland': 'SOM',
+             'Kosovo': 'OWID_KOS'}
+
+# prefix of Our World in Data codes for groups of countries, such as
+# OWID_WRL for the world, which have no shape of their own
+AGGREGATE_PREFIX = 'OWID_'
+
+# tolerances the shapes are simplified to, in the units of the shapes,
+# degrees for the built-in shapes
+SIMPLIFY_TOLERANCES = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5)
+
+
+def get_world(cache_dir=final_project_cache.CACHE_DIR, tolerance=0):
+    '''
+    Takes the cache directory as an optional parameter. Loads the
+    geopandas built-in country shapes, fills in missing iso codes
+    so they match the COVID-19 dataset, and keeps only the columns
+    used by the maps. The result is stored in the cache directory
+    and loaded from there on later runs, and is kept in memory for
+    the rest of the process, so it must not be modified by callers.
+    If a tolerance from get_tolerance is given, the shapes are
+    simplified so no point moves further than it, keeping each shape
+    valid, and the simplified copy is stored the same way.
+    Returns GeoDataFrame.
+    '''
+    return(_get_world(*_get_world_key(cache_dir, tolerance)))
+
+
+def _get_world_key(cache_dir, tolerance):
+    '''
+    Takes the cache directory and the tolerance as parameters. Returns
+    tuple of the two in one form, so the shapes are kept in memory
+    once however the public functions were called.
+    '''
+    return(os.path.abspath(cache_dir), float(tolerance))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_world(cache_dir, tolerance):
+    '''
+    Takes the cache directory and the tolerance from _get_world_key as
+    parameters. Returns the country shapes for get_world.
+    '''
+    with final_project_timing.stage('geometry load'):
+        return(_load_world(cache_dir, tolerance))
+
+
+def _load_world(cache_dir, tolerance):
+    '''
+    Takes the cache directory and the tolerance as parameters. Returns
+    the country shapes for get_world, from the cache directory if
+    stored there.
+    '''
+    import geopandas as gpd
+
+    path = os.path.join(cache_dir, 'world-v%d' % WORLD_VERSION)
+    if tolerance > 0:
+        path = path + '-s%g' % tolerance
+    if os.path.exists(path + '.parquet'):
+        return(gpd.read_parquet(path + '.parquet'))
+    if os.path.exists(path + '.pkl'):
+        return(gpd.GeoDataFrame(final_project_cache.load_frame(path)))
+
+    if tolerance > 0:
+        # all shapes are simplified at once
+        world = get_world(cache_dir).copy()
+        world['geometry'] = world.geometry.simplify(tolerance,
+                                                    preserve_topology=True)
+    else:
+        # load geopandas built-in variable for country shapes
+        world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
+
+        # Fill in missing iso codes for countries in world data
+        for name, iso_code in ISO_FIXES.items():
+            world.loc[world['name'] == name, 'iso_a3'] = iso_code
+        world = world[WORLD_COLUMNS]
+
+    final_project_cache.save_frame(world, path)
+    return(world)
+
+
+def get_tolerance(figsize, dpi=100, cache_dir=final_project_cache.CACHE_DIR):
+    '''
+    Takes the size of a figure in inches as a parameter, and optionally
+    its dots per inch and the cache directory. Finds the size of one
+    pixel if the whole figure showed all the shapes, which is never
+    larger than a pixel of the map itself. Returns the largest level
+    of SIMPLIFY_TOLERANCES under that size, or 0 to keep the full
+    shapes.
+    '''
+    bounds = get_world(cache_dir).total_bounds
+    pixel = max((bounds[2] - bounds[0]) / (figsize[0] * dpi),
+                (bounds[3] - bounds[1]) / (figsize[1] * dpi))
+    levels = [level for level in SIMPLIFY_TOLERANCES if level <= pixel]
+    return(max(levels, default=0))
+
+
+def get_world_index(cache_dir=final_project_cache.CACHE_DIR, tolerance=0):
+    '''
+    Takes the cache directory and the tolerance of the shapes from
+    get_tolerance as optional parameters. Builds an
+    index from each iso code of the country shapes to its rows, and
+    a copy of the shapes with the rows of each code next to each
+    other, in the order of the index, and one extra empty row at the
+    end. A code can have several shapes, such as Somalia and
+    Somaliland, so the rows of position i of the index are offsets[i]
+    up to offsets[i + 1], and position -1, used for codes without a
+    shape, takes the empty row. Shapes without an iso code are left
+    out of the index. Returns tuple of pandas index, numpy array of
+    offsets and GeoDataFrame.
+    '''
+    return(_get_world_index(*_get_world_key(cache_dir, tolerance)))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_world_index(cache_dir, tolerance):
+    '''
+    Takes the cache directory and the tolerance from _get_world_key as
+    parameters. Returns the output of get_world_index.
+    '''
+    import geopandas as gpd
+
+    world = get_world(cache_dir, tolerance)
+    codes = world['iso_a3'].where(world['iso_a3'] != '-99').dropna()
+    code_numbers, index_codes = pd.factorize(codes.to_numpy())
+    index = pd.Index(index_codes)
+    order = np.argsort(code_numbers, kind='stable')
+    offsets = np.searchsorted(code_numbers[order], np.arange(len(index) + 1))
+
+    # rows of each code in the order of the index, then the empty row
+    world = world.iloc[codes.index.to_numpy()[order]]
+    world = world.reset_index(drop=True)
+    empty_row = gpd.GeoDataFrame({column: [None]
+                                  for column in world.columns},
+                                 geometry='geometry', crs=world.crs)
+    world = pd.concat([world, empty_row], ignore_index=True)
+    return(index, offsets, gpd.GeoDataFrame(world, geometry='geometry',
+                                            crs=world.crs))
+
+
+def get_shape_rows(index, offsets, iso_codes):
+    '''
+    Takes index and offsets from get_world_index and list of iso codes
+    as parameters. Finds the rows of the shapes of each code, one row
+    for each shape of the code and the empty row for codes without a
+    shape. Returns tuple of numpy array of the position in iso_codes
+    of each row, and numpy array of the rows.
+    '''
+    positions = index.get_indexer(np.asarray(iso_codes, dtype=object))
+    starts = np.where(positions >= 0, offsets[positions], offsets[-1])
+    counts = np.where(positions >= 0,
+                      offsets[positions + 1] - offsets[positions], 1)
+    code_rows = np.repeat(np.arange(len(positions)), counts)
+    # number of each row among the shapes of its code
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    rows = np.repeat(starts, counts) + np.arange(len(code_rows)) - first
+    return(code_rows, rows)
+
+
+def get_world_paths(cache_dir=final_project_cache.CACHE_DIR, tolerance=0):
+    '''
+    Takes the cache directory and the tolerance of the shapes from
+    get_tolerance as optional parameters. Turns each
+    country shape from get_world into one Matplotlib path of all its
+    polygons and their holes, closed the same way geopandas closes
+    them, so a map drawn from the paths has the same pixels as one
+    drawn by geopandas. Built once per process, so the base layer of
+    every map reuses the same paths. Returns tuple of the list of
+    paths, a numpy array of the row of the shape of each path, and
+    the aspect ratio geopandas gives a map of the shapes.
+    '''
+    return(_get_world_paths(*_get_world_key(cache_dir, tolerance)))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_world_paths(cache_dir, tolerance):
+    '''
+    Takes the cache directory and the tolerance from _get_world_key as
+    parameters. Returns the output of get_world_paths.
+    '''
+    from matplotlib.path import Path
+
+    world = get_world(cache_dir, tolerance)
+    paths = []
+    rows = []
+    for row, geometry in enumerate(world.geometry):
+        if geometry is None or geometry.is_empty:
+            continue
+        rings = [ring for polygon in getattr(geometry, 'geoms', [geometry])
+                 for ring in [polygon.exterior] + list(polygon.interiors)]
+        paths.append(Path.make_compound_path(
+            *[Path(np.asarray(ring.coords)[:, :2], closed=True)
+              for ring in rings]))
+        rows.append(row)
+
+    # longitude and latitude are stretched like geopandas does
+    aspect = 'equal'
+    if world.crs is not None and world.crs.is_geographic:
+        bounds = world.total_bounds
+        aspect = 1 / np.cos(np.mean([bounds[1], bounds[3]]) * np.pi / 180)
+    return(paths, np.array(rows, dtype=int), aspect)
+
+
+def get_unmatched_countries(iso_codes,
+                            cache_dir=final_project_cache.CACHE_DIR):
+    '''
+    Takes list of iso codes as a parameter, and optionally the cache
+    directory. Returns sorted list of the codes with no country
+    shape, leaving out Our World in Data groups of countries.
+    '''
+    index, offsets, world = get_world_index(cache_dir)
+    iso_codes = pd.Index(pd.unique(np.asarray(iso_codes, dtype=object)))
+    missing = iso_codes[index.get_indexer(iso_codes) < 0]
+    # groups of countries are expected to have no shape
+    return(sorted(code for code in missing
+                  if code in ISO_FIXES.values() or
+                  not str(code).startswith(AGGREGATE_PREFIX)))
+
+
+def join_world(df, key='iso_code',
+               cache_dir=final_project_cache.CACHE_DIR):
+    '''
+    Takes pandas dataframe with one row per country as a parameter,
+    and optionally the name of its iso code column and the cache
+    directory. Adds the name, iso_a3 and geometry columns of the
+    matching country shapes to each row by taking rows of the shapes
+    from get_shape_rows, repeating the row of a country with several
+    shapes once for each, and with empty values for codes without a
+    shape. Warns about the countries that have no shape. Returns
+    GeoDataFrame.
+    '''
+    import geopandas as gpd
+
+    index, offsets, world = get_world_index(cache_dir)
+
+    unmatched = get_unmatched_countries(df[key], cache_dir)
+    if len(unmatched) > 0:
+        warnings.warn('No country shapes for iso codes: ' +
+                      ', '.join(unmatched), stacklevel=2)
+
+    with final_project_timing.stage('join', rows=len(df)):
+        code_rows, rows = get_shape_rows(index, offsets, df[key])
+        shapes = world.take(rows).reset_index(drop=True)
+        merged_df = pd.concat([df.take(code_rows).reset_index(drop=True),
+                               shapes], axis=1)
+        merged_df = gpd.GeoDataFrame(merged_df, geometry='geometry',
+                                     crs=world.crs)
+    return(merged_df)
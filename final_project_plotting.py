@@ -9,17 +9,87 @@ as a parameter. Then, each function outputs a plot, get_q1_plot and
 get_q3_xy_plot as an Altair object and get_q2_plot and
 get_q3_map_plot as a Matplotlib object, which then can be saved
 in main. Altair plots are interactive, therefore they must be saved
-as a '.html' file.
+as a '.html' file. render_outputs builds and saves the plots in
+parallel worker processes, or get_output_dfs and render_output_dfs
+do each half of it. write_chart_data writes the data of
+the Altair plots to one shared file they can reference.
+save_q2_animation saves a time-lapse of the q2 map, one frame per
+day, drawing the country shapes once and only recoloring them.
+Altair and Matplotlib are imported by the functions that draw
+with them, so processing only callers do not pay for loading them.
 '''
 
 
-import altair as alt
-import geopandas as gpd
-import matplotlib.pyplot as plt
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
 import final_project_processing_163
+import final_project_cache
+import final_project_geometry
+import final_project_timing
 
 
-def get_q1_plot(q1_plot_df):
+# fields encoded by each Altair plot, with the number of decimals
+# shown for number fields
+CHART_FIELDS = {'q1': {'date': None,
+                       'location': None,
+                       'percent_vaccinated': 2},
+                'q3_xy': {'location': None,
+                          'percent_vaccinated': 2,
+                          'gdp_per_capita': 2,
+                          'total_cases': 0}}
+
+
+def get_chart_data(chart, df, data_url=None):
+    '''
+    Takes name of an Altair plot from CHART_FIELDS and its processed
+    dataframe as parameters, and optionally the url of a file written
+    by write_chart_data. Keeps only the fields the plot encodes and
+    rounds numbers to the precision shown. If data_url is given, the
+    plot instead references the rows of that chart in the shared file.
+    Returns pandas dataframe or Altair data.
+    '''
+    if data_url is not None:
+        import altair as alt
+        return(alt.Data(url=data_url, format=alt.DataFormat(type='json')))
+
+    fields = CHART_FIELDS[chart]
+    chart_df = df[list(fields)].copy()
+    for field, decimals in fields.items():
+        if decimals is not None:
+            chart_df[field] = chart_df[field].astype(float).round(decimals)
+        elif field == 'date':
+            # dates only, without a time of day
+            chart_df[field] = \
+                pd.to_datetime(chart_df[field]).dt.strftime('%Y-%m-%d')
+        else:
+            chart_df[field] = chart_df[field].astype(str)
+    return(chart_df.reset_index(drop=True))
+
+
+def write_chart_data(chart_dfs, path):
+    '''
+    Takes dictionary from Altair plot names in CHART_FIELDS to their
+    processed dataframes, and the path of a JSON file, as parameters.
+    Writes the slimmed rows of all plots to the file, each marked with
+    the name of its plot, so several plots can share one data file
+    through the data_url parameter of get_q1_plot and get_q3_xy_plot.
+    '''
+    records = []
+    for chart, df in chart_dfs.items():
+        chart_df = get_chart_data(chart, df)
+        chart_df['chart'] = chart
+        records.extend(json.loads(chart_df.to_json(orient='records')))
+    with open(path, 'w') as file:
+        json.dump(records, file, separators=(',', ':'))
+
+
+def get_q1_plot(q1_plot_df, data_url=None):
     '''
     Takes processed pandas dataframe from final_project_processing
     as a parameter. Plots top 10 countries with highest percentage
@@ -27,14 +97,22 @@ def get_q1_plot(q1_plot_df):
     displays vertical ruler on top of chart based on the x-position
     of the cursor. Highlights points that are currently selected, and
     displays text with percentage vaccinated for each selected point.
+    Only the encoded fields are kept in the plot, or if data_url is
+    given, the rows are read from that file from write_chart_data.
     Returns an altair plot.
     '''
+    import altair as alt
+
+    base = alt.Chart(get_chart_data('q1', q1_plot_df, data_url))
+    if data_url is not None:
+        base = base.transform_filter(alt.datum.chart == 'q1')
+
     # plot percentage vaccinated vs time with color corresponting to country
-    line = alt.Chart(q1_plot_df).mark_line().encode(
+    line = base.mark_line().encode(
         x=alt.X('date:T', axis=alt.Axis(title='Date')),
         y=alt.Y('percent_vaccinated:Q',
                 axis=alt.Axis(title='Percent Vaccinated')),
-        color=alt.Color('location',
+        color=alt.Color('location:N',
                         legend=alt.Legend(title='Country'),
                         sort=alt.EncodingSortField('percent_vaccinated:Q',
                                                    op='max',
@@ -46,7 +124,7 @@ def get_q1_plot(q1_plot_df):
                             encodings=['x'], empty='none')
 
     # transparent selectors across the chart. gives location of cursor
-    selectors = alt.Chart(q1_plot_df).mark_point().encode(
+    selectors = base.mark_point().encode(
         x='date:T',
         opacity=alt.value(0)
     ).add_selection(
@@ -64,7 +142,7 @@ def get_q1_plot(q1_plot_df):
     )
 
     # draw a vertical ruler using cursor position
-    rules = alt.Chart(q1_plot_df).mark_rule(color='grey').encode(
+    rules = base.mark_rule(color='grey').encode(
         x='date:T'
     ).transform_filter(
         nearest
@@ -99,12 +177,16 @@ def get_q2_plot(q2_map_df):
     missing data. In this context, it represents the country
     has yet to start distibuting vaccines. Returns plotted map.
     '''
-    # load geopandas built-in variable for country shapes
-    world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
+    import matplotlib.pyplot as plt
 
+    # country shapes, built into paths once per run and simplified
+    # to the detail one pixel of the figure can show
     fig, ax = plt.subplots(1, figsize=(10, 8))
     ax.axis('off')
-    world.plot(ax=ax, color='#EEEEEE', edgecolor='#FFFFFF')
+    tolerance = final_project_geometry.get_tolerance((10, 8), fig.dpi)
+    _add_base_layer(ax, tolerance, facecolor='#EEEEEE',
+                    edgecolor='#FFFFFF')
+    q2_map_df = _simplify_layer(q2_map_df, tolerance)
     q2_map_df.plot(ax=ax,
                    column='percent_vaccinated',
                    legend=True, vmin=0, vmax=100,
@@ -115,7 +197,7 @@ def get_q2_plot(q2_map_df):
     return(fig)
 
 
-def get_q3_xy_plot(q3_xy_plot_df):
+def get_q3_xy_plot(q3_xy_plot_df, data_url=None):
     '''
     Takes processed pandas dataframe from final_project_processing
     as a parameter. Plots two separate scatter plots:
@@ -126,10 +208,18 @@ def get_q3_xy_plot(q3_xy_plot_df):
     For both plots, a tooltip was added so that by mvoing the cursor
     over a point, the country name, percentage vaccinated, GDP per
     capita, and total COVID-19 cases is displayed in a text box.
-    The figures are then put side by side. Returns an altair plot.
+    The figures are then put side by side. Only the encoded fields
+    are kept in the plot, or if data_url is given, the rows are read
+    from that file from write_chart_data. Returns an altair plot.
     '''
+    import altair as alt
+
+    base = alt.Chart(get_chart_data('q3_xy', q3_xy_plot_df, data_url))
+    if data_url is not None:
+        base = base.transform_filter(alt.datum.chart == 'q3_xy')
+
     # plot log vs log correlation
-    scatter_log = alt.Chart(q3_xy_plot_df).mark_point().encode(
+    scatter_log = base.mark_point().encode(
         alt.Y('percent_vaccinated:Q',
               scale=alt.Scale(type='log'),
               title='Percentage Vaccinated'),
@@ -152,17 +242,17 @@ def get_q3_xy_plot(q3_xy_plot_df):
     )
 
     # plot x vs y correlation
-    scatter = alt.Chart(q3_xy_plot_df).mark_point().encode(
+    scatter = base.mark_point().encode(
         alt.Y('percent_vaccinated:Q',
               title='Percentage Vaccinated'),
         alt.X('gdp_per_capita:Q',
               title='GDP Per Capita'),
         tooltip=[alt.Tooltip('location:N', title='Country'),
-                 alt.Tooltip('percent_vaccinated',
+                 alt.Tooltip('percent_vaccinated:Q',
                              title='Percent Vaccinated'),
-                 alt.Tooltip('gdp_per_capita',
+                 alt.Tooltip('gdp_per_capita:Q',
                              title='GDP Per Capita'),
-                 alt.Tooltip('total_cases',
+                 alt.Tooltip('total_cases:Q',
                              title='Total Cases')]
     ).properties(
         width=600, height=600,
@@ -185,13 +275,16 @@ def get_q3_map_plot(q3_map_plot_df):
     choropleth map of all countries with hue corresponding to
     GDP per capita. Returns matplotlib plot.
     '''
-    # load geopandas built-in variable for country shapes
-    world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
+    import matplotlib.pyplot as plt
 
-    # plot with hue corresponding to GDP per capita
+    # plot with hue corresponding to GDP per capita, over the
+    # country shapes built into paths once per run, all simplified
+    # to the detail one pixel of the figure can show
     fig, ax = plt.subplots(1, figsize=(10, 8))
     ax.axis('off')
-    world.plot(ax=ax, color='#CCCCCC')
+    tolerance = final_project_geometry.get_tolerance((10, 8), fig.dpi)
+    _add_base_layer(ax, tolerance, facecolor='#CCCCCC', edgecolor='none')
+    q3_map_plot_df = _simplify_layer(q3_map_plot_df, tolerance)
     q3_map_plot_df.plot(ax=ax,
                         column='gdp_per_capita',
                         legend=True,
@@ -201,22 +294,367 @@ def get_q3_map_plot(q3_map_plot_df):
     return(fig)
 
 
+def _add_base_layer(ax, tolerance=0, **style):
+    '''
+    Takes Matplotlib axes, and optionally the tolerance of the shapes
+    from get_tolerance and the style of the shapes, such as facecolor
+    and edgecolor, as parameters. Adds every country shape to the axes
+    as one collection built from the paths kept by get_world_paths,
+    without converting the shapes again, and sizes the axes to fit
+    them. Returns the collection.
+    '''
+    from matplotlib.collections import PathCollection
+
+    paths, rows, aspect = final_project_geometry.get_world_paths(
+        tolerance=tolerance)
+    shapes = PathCollection(paths, **style)
+    ax.add_collection(shapes)
+    ax.autoscale_view()
+    ax.set_aspect(aspect)
+    return(shapes)
+
+
+def _simplify_layer(map_df, tolerance):
+    '''
+    Takes GeoDataFrame from join_world and the tolerance of the shapes
+    from get_tolerance as parameters. Swaps each shape for its stored
+    simplified copy, looked up by its name, as one iso_a3 code can
+    have several shapes. Returns GeoDataFrame.
+    '''
+    if tolerance == 0:
+        return(map_df)
+    index, offsets, world = final_project_geometry.get_world_index(
+        tolerance=tolerance)
+    names = pd.Index(world['name'].iloc[:-1].astype(object))
+    positions = names.get_indexer(map_df['name'].astype(object))
+    map_df = map_df.copy()
+    map_df['geometry'] = world.geometry.take(positions).to_numpy()
+    return(map_df)
+
+
+# file each output is saved to, by output name
+OUTPUTS = {'q1': 'q1.html',
+           'q2': 'q2_map.png',
+           'q3_xy': 'q3_xy.html',
+           'q3_map': 'q3_map.png'}
+
+
+def render_outputs(data, outputs=None, max_workers=None, chart_data=None,
+                   q1_points=None, as_of=None):
+    '''
+    Takes filtered pandas dataframe as a parameter, and optionally a
+    list of output names from OUTPUTS, the number of worker processes,
+    the path of a shared data file for the Altair plots, the
+    number of points to downsample each country of the q1 plot to,
+    and a date to plot the data as of.
+    Processes the data for each output in this process,
+    sharing one snapshot, then builds and saves the plots at the same
+    time in a pool of worker processes using the headless Agg
+    Matplotlib backend. If chart_data is given, the Altair plots
+    reference their data in that file instead of inlining it.
+    Returns dictionary from each output name to the seconds it took
+    to build and save its plot.
+    '''
+    output_dfs = get_output_dfs(data, outputs, q1_points, as_of)
+    return(render_output_dfs(output_dfs, max_workers, chart_data))
+
+
+def get_output_dfs(data, outputs=None, q1_points=None, as_of=None):
+    '''
+    Takes filtered pandas dataframe as a parameter, and optionally a
+    list of output names from OUTPUTS, the number of points to
+    downsample each country of the q1 plot to, and a date to process
+    the data as of. Processes the data for each output, sharing one
+    snapshot, and one table of the country columns from
+    split_country_data. Returns dictionary from each output name to
+    the processed dataframe its plot is built from.
+    '''
+    if outputs is None:
+        outputs = list(OUTPUTS)
+
+    # rows sorted into one slice per country, and the most recent
+    # day for each country, shared by all questions
+    with final_project_timing.stage('country index', rows=len(data)):
+        country_index = final_project_processing_163.get_country_index(data)
+    if as_of is None:
+        snapshot = final_project_processing_163.get_snapshot(data,
+                                                             country_index)
+    else:
+        snapshot = final_project_processing_163.get_as_of_snapshot(
+            final_project_processing_163.get_as_of_snapshots(
+                data, country_index), as_of)
+
+    # one row per country for the outputs built from country columns
+    country_data = None
+    if 'q3_map' in outputs:
+        with final_project_timing.stage('split countries', rows=len(data)):
+            country_data = final_project_processing_163.split_country_data(
+                data)[0]
+
+    output_dfs = {}
+    for output in outputs:
+        with final_project_timing.stage('process ' + output) as record:
+            output_dfs[output] = _get_output_df(output, data, snapshot,
+                                                q1_points, country_index,
+                                                as_of, country_data)
+            record['rows'] = len(output_dfs[output])
+    return(output_dfs)
+
+
+def render_output_dfs(output_dfs, max_workers=None, chart_data=None):
+    '''
+    Takes dictionary from output names in OUTPUTS to their processed
+    dataframes as a parameter, and optionally the number of worker
+    processes and the path of a shared data file for the Altair plots.
+    Builds and saves the plots at the same time in a pool of worker
+    processes using the headless Agg Matplotlib backend. Returns
+    dictionary from each output name to the seconds it took to build
+    and save its plot.
+    '''
+    # one data file for all Altair plots
+    if chart_data is not None:
+        write_chart_data({output: df for output, df in output_dfs.items()
+                          if output in CHART_FIELDS}, chart_data)
+
+    timing = final_project_timing.is_enabled()
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_worker,
+                             initargs=(timing,)) as executor:
+        futures = {output: executor.submit(_render_output, output, df,
+                                           chart_data)
+                   for output, df in output_dfs.items()}
+        times = {}
+        for output, future in futures.items():
+            times[output], records = future.result()
+            final_project_timing.add_records(records)
+        return(times)
+
+
+def _get_output_df(output, data, snapshot, q1_points=None,
+                   country_index=None, as_of=None, country_data=None):
+    '''
+    Takes output name from OUTPUTS, filtered pandas dataframe, and its
+    snapshot from get_snapshot as parameters, and optionally the number
+    of points to downsample each country of the q1 plot to, the
+    output of get_country_index for the data, the date the snapshot
+    is as of, and the country table from split_country_data. Returns
+    the processed dataframe the plot of that output is built from.
+    '''
+    processing = final_project_processing_163
+    if output == 'q1':
+        q1_df = processing.get_q1_df(data, snapshot,
+                                     country_index=country_index,
+                                     as_of=as_of)
+        if q1_points is not None:
+            q1_df = processing.downsample_q1_df(q1_df, q1_points)
+        return(q1_df)
+    if output == 'q2':
+        return(processing.get_q2_map_df(data, snapshot, country_index))
+    if output == 'q3_xy':
+        return(processing.get_q3_xy_df(data, snapshot, country_index))
+    if output == 'q3_map':
+        return(processing.get_q3_map_df(data, country_index=country_index,
+                                        country_data=country_data))
+    raise ValueError('Unknown output: ' + output)
+
+
+def _init_worker(timing=False):
+    '''
+    Takes optionally whether stages are recorded as a parameter.
+    Switches a worker process to the headless Agg Matplotlib backend,
+    and records stages in it if they are recorded in the main process.
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    final_project_timing.enable(timing)
+
+
+def _render_output(output, df, chart_data=None):
+    '''
+    Takes output name from OUTPUTS and its processed dataframe as
+    parameters, and optionally the shared data file for the Altair
+    plots. Builds the plot and saves it to its file, recording the
+    saving as a stage of its own. Returns tuple
+    of the seconds it took and the stages recorded while doing so.
+    '''
+    import matplotlib.pyplot as plt
+
+    final_project_timing.reset()
+    start = time.perf_counter()
+    with final_project_timing.stage('render ' + output, rows=len(df)):
+        if output == 'q1':
+            plot = get_q1_plot(df, chart_data)
+        elif output == 'q2':
+            plot = get_q2_plot(df)
+        elif output == 'q3_xy':
+            plot = get_q3_xy_plot(df, chart_data)
+        elif output == 'q3_map':
+            plot = get_q3_map_plot(df)
+
+        # writing the file is its own stage, apart from building the plot
+        with final_project_timing.stage('save ' + output):
+            if hasattr(plot, 'savefig'):
+                plot.savefig(OUTPUTS[output])
+                plt.close(plot)
+            else:
+                plot.save(OUTPUTS[output])
+    return(time.perf_counter() - start, final_project_timing.get_report())
+
+
+def save_q2_animation(data, path='q2_animation.gif', every=1,
+                      max_workers=None, fps=10):
+    '''
+    Takes filtered pandas dataframe as a parameter, and optionally the
+    path to save to, the number of days between frames, the number of
+    worker processes and the frames per second. Saves a time-lapse of
+    the q2 map with one frame per day, or every few days ending with
+    the last day. Each worker draws the country
+    shapes once, then for each of its frames only changes the colors
+    of the shapes and the title before saving the frame. If the path
+    ends with '.gif' the frames are joined into a GIF, otherwise the
+    path is a directory the frames are saved to as PNG files. Returns
+    the number of frames.
+    '''
+    processing = final_project_processing_163
+    with final_project_timing.stage('process q2 frames') as record:
+        dates, countries, values = processing.get_q2_frames(data,
+                                                            every=every)
+        record['rows'] = len(dates)
+
+    # values for each shape, in the order of the shape index
+    index, offsets, world = final_project_geometry.get_world_index()
+    positions = index.get_indexer(countries.astype(object))
+    shape_values = np.full((len(dates), len(index)), np.nan, np.float32)
+    shape_values[:, positions[positions >= 0]] = values[:, positions >= 0]
+    labels = [str(date)[:10] for date in dates]
+
+    if not path.lower().endswith('.gif'):
+        os.makedirs(path, exist_ok=True)
+        _render_frames(path, shape_values, labels, max_workers)
+        return(len(dates))
+
+    # frames of a GIF are removed even if rendering or saving fails
+    with tempfile.TemporaryDirectory() as directory:
+        _render_frames(directory, shape_values, labels, max_workers)
+        with final_project_timing.stage('save gif', rows=len(dates)):
+            _save_gif(directory, len(dates), path, fps)
+    return(len(dates))
+
+
+def _render_frames(directory, shape_values, labels, max_workers):
+    '''
+    Takes the frame directory, numpy array of the values of each shape
+    in each frame, the date of each frame and the number of worker
+    processes as parameters. Saves the frames of the q2 time-lapse in
+    a pool of workers, one run of frames per worker, so each draws the
+    shapes once.
+    '''
+    workers = max_workers or os.cpu_count() or 1
+    runs = np.array_split(np.arange(len(labels)), workers)
+    timing = final_project_timing.is_enabled()
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_worker,
+                             initargs=(timing,)) as executor:
+        futures = [executor.submit(_render_q2_frames, directory,
+                                   run, shape_values[run],
+                                   [labels[frame] for frame in run])
+                   for run in runs if len(run) > 0]
+        for future in futures:
+            final_project_timing.add_records(future.result())
+
+
+def _render_q2_frames(directory, frames, shape_values, labels):
+    '''
+    Takes the frame directory, numpy array of frame numbers, numpy
+    array of the percent vaccinated of each shape in each of those
+    frames, in the order of the index from get_world_index, and the
+    date of each frame as parameters. Draws the q2 map once, then
+    saves each frame after setting the colors of the shapes from its
+    values. Returns the stages recorded while doing so.
+    '''
+    import matplotlib.pyplot as plt
+
+    final_project_timing.reset()
+    with final_project_timing.stage('render q2 frames', rows=len(frames)):
+        fig, ax = plt.subplots(1, figsize=(10, 8))
+        ax.axis('off')
+        tolerance = final_project_geometry.get_tolerance((10, 8), fig.dpi)
+
+        # every shape is drawn, those without data stay grey
+        index = final_project_geometry.get_world_index()[0]
+        world = final_project_geometry.get_world(tolerance=tolerance)
+        paths, rows, aspect = final_project_geometry.get_world_paths(
+            tolerance=tolerance)
+        columns = index.get_indexer(world['iso_a3'])[rows]
+
+        shapes = _add_base_layer(ax, tolerance, edgecolor='#FFFFFF',
+                                 cmap='viridis')
+        shapes.set_clim(0, 100)
+        shapes.get_cmap().set_bad('#EEEEEE')
+        fig.colorbar(shapes, ax=ax, orientation='horizontal',
+                     label='Percentage Vaccinated')
+        title = ax.set_title('')
+
+        for frame, values, label in zip(frames, shape_values, labels):
+            values = np.append(values, np.nan)[columns]
+            shapes.set_array(np.ma.masked_invalid(values))
+            title.set_text('Percentage of Population with One Dose of '
+                           'COVID-19 Vaccine by Country, ' + label)
+            fig.savefig(os.path.join(directory, 'frame-%05d.png' % frame))
+        plt.close(fig)
+    return(final_project_timing.get_report())
+
+
+def _save_gif(directory, count, path, fps):
+    '''
+    Takes the frame directory, the number of frames, the path of the
+    GIF and the frames per second as parameters. Joins the frames
+    saved by _render_q2_frames into a GIF that repeats forever.
+    '''
+    from PIL import Image
+
+    def frames():
+        for frame in range(1, count):
+            yield Image.open(os.path.join(directory,
+                                          'frame-%05d.png' % frame))
+
+    # later frames are read one at a time while the GIF is written
+    first = Image.open(os.path.join(directory, 'frame-00000.png'))
+    first.save(path, save_all=True, append_images=frames(),
+               duration=int(1000 / fps), loop=0)
+    first.close()
+
+
 def main():
+    parser = argparse.ArgumentParser(
+        description='Process the COVID-19 dataset and save all plots.')
+    parser.add_argument('--timing', metavar='PATH',
+                        help='record each stage, and print the report, '
+                             'or write it to PATH if it is not -')
+    parser.add_argument('--as-of', metavar='DATE',
+                        help='plot the data as of a past date, such as '
+                             '2021-01-31')
+    parser.add_argument('--animate', metavar='PATH',
+                        help='also save a time-lapse of the q2 map to a '
+                             'GIF, or to a directory of frames')
+    args = parser.parse_args()
+    final_project_timing.enable(args.timing is not None)
+
     data = final_project_processing_163.get_filtered_data(
                             'https://covid.ourworldindata.org/data/'
-                            'owid-covid-data.csv?v=2021-02-17')
-    q1_df = final_project_processing_163.get_q1_df(data)
-    q2_map_df = final_project_processing_163.get_q2_map_df(data)
-    q3_xy_df = final_project_processing_163.get_q3_xy_df(data)
-    q3_map_df = final_project_processing_163.get_q3_map_df(data)
-    q1_plot = get_q1_plot(q1_df)
-    q1_plot.save('q1.html')
-    q2_map_plot = get_q2_plot(q2_map_df)
-    q2_map_plot.savefig('q2_map.png')
-    q3_xy_plot = get_q3_xy_plot(q3_xy_df)
-    q3_map_plot = get_q3_map_plot(q3_map_df)
-    q3_xy_plot.save('q3_xy.html')
-    q3_map_plot.savefig('q3_map.png')
+                            'owid-covid-data.csv?v=2021-02-17',
+                            cache_dir=final_project_cache.CACHE_DIR)
+    times = render_outputs(data, as_of=args.as_of)
+    for output, seconds in times.items():
+        print(OUTPUTS[output], round(seconds, 2), 'seconds')
+    if args.animate is not None:
+        frames = save_q2_animation(data, args.animate)
+        print(args.animate, frames, 'frames')
+
+    if args.timing == '-':
+        final_project_timing.print_report()
+    elif args.timing is not None:
+        final_project_timing.write_report(args.timing)
 
 
 if __name__ == "__main__":
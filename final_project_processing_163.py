@@ -3,7 +3,14 @@ Matthew Friedrich
 CSE 163 Section AG
 
 This file contains the functions get_filtered_data,
-get_q1_df, get_q2_map_df, get_q3_xy_df, and get_q3_map_df.
+get_mapped_country_index, compare_ingest, split_country_data,
+join_country_data, get_latest_data, get_snapshot,
+get_as_of_snapshots, get_as_of_snapshot, get_q2_frames,
+get_incremental_data,
+stream_country_state, read_country_rows,
+get_streamed_q1_df, get_q1_df, get_top_countries, get_country_index,
+get_country_rows, get_first_rows, get_last_rows, downsample_q1_df,
+get_q2_map_df, get_q3_xy_df, get_gdp_data, and get_q3_map_df.
 Each of these functions are used to process data in
 the COVID-19 dataset acquired from Our World in Data.
 These functions are used in the file final_project_plotting.py,
@@ -12,70 +19,773 @@ of our research questions.
 '''
 
 
+import os
+import time
+import urllib.request
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-from geopandas import GeoDataFrame
+import final_project_cache
+import final_project_geometry
+import final_project_timing
 
 
-def get_filtered_data(file_url):
+# columns of the COVID-19 dataset used in our analysis
+RELEVANT_COLUMNS = ['iso_code', 'continent', 'location',
+                    'date', 'total_cases', 'total_vaccinations',
+                    'people_vaccinated', 'people_fully_vaccinated',
+                    'new_vaccinations', 'population', 'gdp_per_capita']
+
+# compact types for the relevant columns, counters only need float32
+COMPACT_DTYPES = {'iso_code': 'category',
+                  'continent': 'category',
+                  'location': 'category',
+                  'total_cases': 'float32',
+                  'total_vaccinations': 'float32',
+                  'people_vaccinated': 'float32',
+                  'people_fully_vaccinated': 'float32',
+                  'new_vaccinations': 'float32',
+                  'population': 'float32',
+                  'gdp_per_capita': 'float32'}
+
+# compact types the file is read with: categorical columns are read
+# as text and converted afterwards, since pandas reads the file in
+# blocks and cannot join the categories of a block where the column
+# is empty, such as continent in the rows of groups of countries
+READ_DTYPES = {column: object if dtype == 'category' else dtype
+               for column, dtype in COMPACT_DTYPES.items()}
+
+# columns that are the same on every day of a country, kept once per
+# country by split_country_data
+COUNTRY_COLUMNS = ['iso_code', 'continent', 'location',
+                   'population', 'gdp_per_capita']
+
+
+def get_filtered_data(file_url, compact=False, cache_dir=None,
+                      mapped=False, engine='pandas'):
     '''
     Takes url of COVID-19 CSV file as a parameter.
     Reads url of CSV file into a pandas dataframe.
     Fills N/A values with 0, and filters for only
     relevant columns. Returns pandas dataframe.
+    If compact is True, only the relevant columns are
+    read, with categorical country columns, a parsed date
+    and float32 counters. N/A values are then filled with 0
+    only in the number columns.
+    If cache_dir is given, the file is fetched through the
+    cache in final_project_cache.py, and the dataframe is
+    loaded from its binary copy when the file is unchanged.
+    If mapped is also True, the binary copy is one numpy file
+    per column from final_project_cache.dump_columns, opened
+    with memory mapping, so nothing is parsed and the number,
+    date and categorical columns are not copied. Text columns,
+    which only the default mode has, are still built from
+    their dictionary.
+    If engine is 'arrow', the file is read by PyArrow on all
+    cores instead, and the columns stay Arrow arrays in the
+    pandas dataframe, with N/A values filled with 0 only in
+    the number columns. The binary copy is then not used.
     '''
-    df = pd.read_csv(file_url).fillna(0)
-    df_relevant = df[['iso_code', 'continent', 'location',
-                      'date', 'total_cases', 'total_vaccinations',
-                      'people_vaccinated', 'people_fully_vaccinated',
-                      'new_vaccinations', 'population', 'gdp_per_capita']]
+    if engine == 'arrow':
+        if cache_dir is not None:
+            with final_project_timing.stage('fetch'):
+                file_url, digest = final_project_cache.fetch_file(file_url,
+                                                                  cache_dir)
+        return(_read_arrow(file_url, compact))
+    if engine != 'pandas':
+        raise ValueError('Unknown engine: ' + engine)
+
+    if cache_dir is not None:
+        mode = 'compact' if compact else 'default'
+        with final_project_timing.stage('fetch'):
+            path, digest = final_project_cache.fetch_file(file_url,
+                                                          cache_dir)
+        frame_path = final_project_cache.get_frame_path(cache_dir,
+                                                        digest, mode)
+        if mapped:
+            return(_get_mapped_data(path, compact,
+                                    frame_path + '-columns')[0])
+        with final_project_timing.stage('load binary copy') as record:
+            df_relevant = final_project_cache.load_frame(frame_path)
+        if df_relevant is None:
+            df_relevant = get_filtered_data(path, compact=compact)
+            with final_project_timing.stage('save binary copy'):
+                final_project_cache.save_frame(df_relevant, frame_path)
+        else:
+            record['rows'] = len(df_relevant)
+        return(df_relevant)
+
+    with final_project_timing.stage('parse') as record:
+        if compact:
+            df_relevant = pd.read_csv(file_url, usecols=RELEVANT_COLUMNS,
+                                      dtype=READ_DTYPES,
+                                      parse_dates=['date'])
+            df_relevant = _fill_counters(df_relevant[RELEVANT_COLUMNS])
+        else:
+            df = pd.read_csv(file_url).fillna(0)
+            df_relevant = df[RELEVANT_COLUMNS]
+        record['rows'] = len(df_relevant)
     return(df_relevant)
 
 
-def get_q1_df(filtered_data):
+def _get_mapped_data(path, compact, columns_dir):
     '''
-    Takes filtered pandas dataframe as a parameter.
-    Creates new dataframe with same columns which
-    contains the vaccination data for the most recent
-    day which each country has data for. Calculates
-    percent vaccinated on most recent day and takes
-    top 10 countries with highest percent vaccinated.
-    Filters original dataframe to contain only those
-    countries, but for all days. Calculates percent
-    vaccinated for all days for those 10 countries.
-    Returns pandas dataframe with percent vaccinated
-    for all days for top 10 countries.
-    '''
-    # remove countries with population under 1 million
-    # and where total vaccinations is 0
-    df_relevant = filtered_data[filtered_data['population'] >= 1000000]
-    df_relevant = df_relevant[df_relevant['total_vaccinations'] != 0]
-
-    # create new data frame to add most recent day to
-    max_date_df = pd.DataFrame(columns=df_relevant.columns)
-    # duplicate to use later
-    adjusted_top_10_df = max_date_df
-
-    # get list of all countries iso codes
-    countries = df_relevant['iso_code'].unique()
-
-    # Find most recent day for each country
-    # For each country you must check if people vaccinated is zero.
+    Takes path of a fetched COVID-19 CSV file, the compact option and
+    the directory of its columns as parameters. Writes the columns of
+    the filtered data there if they are missing. Returns tuple of the
+    pandas dataframe opened with memory mapping and the dictionary
+    from each country to the slice of its rows.
+    '''
+    if not os.path.exists(os.path.join(columns_dir, 'meta.json')):
+        df_relevant = get_filtered_data(path, compact=compact)
+        with final_project_timing.stage('save columns'):
+            final_project_cache.dump_columns(df_relevant, columns_dir)
+    with final_project_timing.stage('map columns') as record:
+        df_relevant, country_slices = final_project_cache.load_columns(
+            columns_dir)
+        record['rows'] = len(df_relevant)
+    return(df_relevant, country_slices)
+
+
+def get_mapped_country_index(file_url, cache_dir, compact=False):
+    '''
+    Takes url of COVID-19 CSV file and the cache directory as
+    parameters, and optionally the compact option of
+    get_filtered_data. Opens the data with memory mapping as
+    get_filtered_data does when mapped is True, and builds its
+    country index from the rows of each country stored with the
+    columns, instead of sorting the rows again. Returns the output
+    of get_country_index.
+    '''
+    mode = 'compact' if compact else 'default'
+    with final_project_timing.stage('fetch'):
+        path, digest = final_project_cache.fetch_file(file_url, cache_dir)
+    frame_path = final_project_cache.get_frame_path(cache_dir, digest, mode)
+    df_relevant, country_slices = _get_mapped_data(path, compact,
+                                                   frame_path + '-columns')
+    return(get_country_index(df_relevant, country_slices))
+
+
+def _read_arrow(file_url, compact):
+    '''
+    Takes url of COVID-19 CSV file and the compact option as
+    parameters. Reads the relevant columns with the multithreaded
+    PyArrow CSV reader, as dictionary encoded country columns, a
+    parsed date and float32 counters if compact is True, and fills
+    N/A values with 0 in the number columns. Returns pandas dataframe
+    backed by the Arrow arrays.
+    '''
+    import pyarrow as pa
+    import pyarrow.csv
+
+    text = pa.dictionary(pa.int32(), pa.string()) if compact \
+        else pa.string()
+    number = pa.float32() if compact else pa.float64()
+    column_types = {column: number for column in RELEVANT_COLUMNS}
+    column_types.update({'iso_code': text, 'continent': text,
+                         'location': text,
+                         'date': pa.timestamp('s') if compact
+                         else pa.string()})
+
+    with final_project_timing.stage('parse') as record:
+        source = file_url
+        if not os.path.exists(file_url):
+            source = urllib.request.urlopen(file_url)
+        table = pyarrow.csv.read_csv(
+            source,
+            read_options=pyarrow.csv.ReadOptions(use_threads=True),
+            convert_options=pyarrow.csv.ConvertOptions(
+                include_columns=RELEVANT_COLUMNS,
+                column_types=column_types))
+        for position, column in enumerate(table.column_names):
+            if column_types[column] == number:
+                table = table.set_column(position, column,
+                                         table[column].fill_null(0))
+        df_relevant = table.unify_dictionaries().to_pandas(
+            types_mapper=pd.ArrowDtype)
+        record['rows'] = len(df_relevant)
+    return(df_relevant)
+
+
+def _fill_counters(df):
+    '''
+    Takes pandas dataframe read in compact mode as a parameter.
+    Converts the text columns to categories and fills N/A values
+    with 0 in the number columns only. Returns pandas dataframe.
+    '''
+    categories = [column for column in RELEVANT_COLUMNS
+                  if COMPACT_DTYPES.get(column) == 'category']
+    counters = [column for column in RELEVANT_COLUMNS
+                if COMPACT_DTYPES.get(column) == 'float32']
+    df = df.astype({column: 'category' for column in categories})
+    df[counters] = df[counters].fillna(0)
+    return(df)
+
+
+def compare_ingest(file_url):
+    '''
+    Takes url of COVID-19 CSV file as a parameter.
+    Reads the file with both the default and the compact mode
+    of get_filtered_data, and measures the parse time and the
+    memory used by each resulting dataframe. Returns dictionary
+    with the bytes and seconds of each mode, the bytes saved and
+    the parse time speedup of the compact mode.
+    '''
+    report = {}
+    for mode, compact in [('default', False), ('compact', True)]:
+        start = time.perf_counter()
+        df = get_filtered_data(file_url, compact=compact)
+        report[mode + '_seconds'] = time.perf_counter() - start
+        report[mode + '_bytes'] = int(df.memory_usage(deep=True).sum())
+    report['bytes_saved'] = report['default_bytes'] - report['compact_bytes']
+    report['speedup'] = report['default_seconds'] / report['compact_seconds']
+    return(report)
+
+
+def split_country_data(filtered_data):
+    '''
+    Takes filtered pandas dataframe as a parameter. Splits it into a
+    table with one row per country of the columns in COUNTRY_COLUMNS,
+    which are the same on every day, and a narrow table of the daily
+    columns, with a small integer country_id for the row of each
+    country in the first table. Countries are numbered in the order
+    they first appear. Population and GDP per capita are the largest
+    value of each country. Returns tuple of the country pandas
+    dataframe and the daily pandas dataframe.
+    '''
+    codes, countries = pd.factorize(filtered_data['iso_code'].astype(object))
+    dtype = np.int16 if len(countries) < 1 << 15 else np.int32
+    first = np.unique(codes, return_index=True)[1]
+
+    country_data = filtered_data[['iso_code', 'continent', 'location']]
+    country_data = country_data.iloc[first].reset_index(drop=True)
+    for column in ['population', 'gdp_per_capita']:
+        values = filtered_data[column].to_numpy()
+        # start below every value, integer columns cannot hold -inf
+        if values.dtype.kind in 'iu':
+            lowest = np.iinfo(values.dtype).min
+        else:
+            lowest = -np.inf
+        largest = np.full(len(countries), lowest, dtype=values.dtype)
+        np.maximum.at(largest, codes, values)
+        country_data[column] = largest
+
+    daily_data = filtered_data[[column for column in RELEVANT_COLUMNS
+                                if column not in COUNTRY_COLUMNS]]
+    daily_data.insert(0, 'country_id', codes.astype(dtype))
+    return(country_data, daily_data)
+
+
+def join_country_data(country_data, daily_data, columns=None):
+    '''
+    Takes the country and daily dataframes from split_country_data as
+    parameters, and optionally the list of columns to keep. Looks up
+    the country columns of each daily row by its country id, which is
+    the position of the country row. Returns pandas dataframe with the
+    columns of get_filtered_data, or only the given columns.
+    '''
+    if columns is None:
+        columns = RELEVANT_COLUMNS
+    ids = daily_data['country_id'].to_numpy()
+    df = pd.DataFrame(index=daily_data.index)
+    for column in columns:
+        if column in COUNTRY_COLUMNS:
+            df[column] = country_data[column].take(ids).to_numpy()
+        else:
+            df[column] = daily_data[column]
+    return(df)
+
+
+def get_latest_data(vacc_data):
+    '''
+    Takes pandas dataframe of rows with vaccination data as a parameter.
+    Finds the most recent row for each country in a single groupby
+    pass instead of scanning the dataframe once per country. Countries
+    keep the order in which they first appear. Replaces people
+    vaccinated with total vaccinations where it is missing and
+    calculates percent vaccinated. Returns pandas dataframe with one
+    row per country.
+    '''
+    # last row for each country
+    latest = vacc_data.groupby('iso_code', sort=False,
+                               observed=True).tail(1)
+    latest = _order_countries(latest, vacc_data['iso_code'].unique())
+    return(_add_latest_percent(latest))
+
+
+def _add_latest_percent(latest):
+    '''
+    Takes pandas dataframe with the most recent row of each country
+    as a parameter. Replaces people vaccinated with total vaccinations
+    where it is missing and calculates percent vaccinated. Returns the
+    pandas dataframe.
+    '''
+    # Replace people vaccinated with total vaccinations if missing.
+    # This is checked only on the most recent day of each country.
+    missing = latest['people_vaccinated'] == 0
+    latest.loc[missing, 'people_vaccinated'] = \
+        latest.loc[missing, 'total_vaccinations']
+
+    # calculate percent vaccinated
+    latest['percent_vaccinated'] = \
+        (latest['people_vaccinated'] / latest['population']) * 100
+
+    return(latest)
+
+
+def _order_countries(df, countries):
+    '''
+    Takes pandas dataframe and a list of country iso codes as parameters.
+    Reorders the rows so that countries follow the order of the list,
+    keeping the original row order within each country. Returns a copy
+    of the reordered pandas dataframe.
+    '''
+    rank = pd.Index(countries).get_indexer(df['iso_code'])
+    return(df.iloc[rank.argsort(kind='stable')].copy())
+
+
+def get_snapshot(filtered_data, country_index=None, engine='pandas'):
+    '''
+    Takes filtered pandas dataframe as a parameter, and optionally
+    the output of get_country_index for it, and the engine, which
+    with 'arrow' filters and groups the rows with PyArrow.
+    Removes days where total vaccinations is 0 and finds the
+    most recent day for each country, with percent vaccinated.
+    The snapshot is built once per run and can be passed to
+    get_q1_df, get_q2_map_df and get_q3_xy_df, which then only
+    apply their own filters. With the country index, the last
+    day of each country is found within its slice of rows.
+    Returns pandas dataframe with one row per country.
+    '''
+    with final_project_timing.stage('snapshot') as record:
+        if engine == 'arrow':
+            snapshot = _get_arrow_snapshot(filtered_data)
+        elif country_index is None:
+            vacc_data = filtered_data[
+                filtered_data['total_vaccinations'] != 0]
+            snapshot = get_latest_data(vacc_data)
+        else:
+            snapshot = _get_indexed_snapshot(country_index)
+        record['rows'] = len(snapshot)
+    return(snapshot)
+
+
+def _get_indexed_snapshot(country_index):
+    '''
+    Takes the output of get_country_index as a parameter. Takes the
+    last row with vaccinations of each country, the highest position
+    with vaccinations in its slice. Returns pandas dataframe like
+    get_latest_data.
+    '''
+    data = country_index['data']
+    if len(data) == 0:
+        return(get_latest_data(data))
+    vaccinated = data['total_vaccinations'].to_numpy() != 0
+    positions = np.where(vaccinated, np.arange(len(data)), -1)
+
+    # every country has at least one row, so no slice is empty
+    last = np.maximum.reduceat(positions, country_index['offsets'][:-1])
+    latest = data.take(last[last >= 0]).copy()
+    return(_add_latest_percent(latest))
+
+
+def _get_arrow_snapshot(filtered_data):
+    '''
+    Takes filtered pandas dataframe as a parameter. Filters the days
+    with vaccinations and finds the last of them for each country with
+    PyArrow, without copying Arrow backed columns. Returns pandas
+    dataframe like get_latest_data.
+    '''
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    table = pa.table({'iso_code': filtered_data['iso_code'],
+                      'total_vaccinations':
+                          filtered_data['total_vaccinations'],
+                      'row': np.arange(len(filtered_data))})
+    table = table.filter(pc.not_equal(table['total_vaccinations'], 0))
+
+    # each block read from the CSV has its own dictionary of codes,
+    # they must be the same to group by them
+    table = table.unify_dictionaries()
+
+    # last row of each country, with countries in the order they
+    # first appear, as the groups do not keep an order
+    groups = table.group_by('iso_code').aggregate(
+        [('row', 'min'), ('row', 'max')])
+    groups = groups.sort_by('row_min')
+    latest = filtered_data.take(groups['row_max'].to_numpy()).copy()
+    return(_add_latest_percent(latest))
+
+
+def get_as_of_snapshots(filtered_data, country_index=None):
+    '''
+    Takes filtered pandas dataframe as a parameter, and optionally the
+    output of get_country_index for it. Builds, for every date in the
+    data, the position of the most recent row with vaccinations of
+    each country on or before that date. Rows are marked in a table
+    of dates by countries, then carried forward with a running
+    maximum, since positions grow with the date within each country.
+    Returns dictionary with the sorted dates under 'dates', the
+    positions as a numpy array with -1 for countries with no row yet
+    under 'positions', and the country index under 'country_index'.
+    '''
+    if country_index is None:
+        country_index = get_country_index(filtered_data)
+    data = country_index['data']
+    offsets = country_index['offsets']
+    with final_project_timing.stage('as of snapshots', rows=len(data)):
+        date_codes, dates = pd.factorize(data['date'], sort=True)
+        country_codes = np.repeat(np.arange(len(offsets) - 1),
+                                  np.diff(offsets))
+        dtype = np.int32 if len(data) < 1 << 31 else np.int64
+
+        positions = np.full((len(dates), len(offsets) - 1), -1, dtype=dtype)
+        vaccinated = np.flatnonzero(data['total_vaccinations'].to_numpy() != 0)
+        positions[date_codes[vaccinated], country_codes[vaccinated]] = \
+            vaccinated
+        np.maximum.accumulate(positions, axis=0, out=positions)
+    return({'dates': pd.Index(dates),
+            'positions': positions,
+            'country_index': country_index})
+
+
+def get_as_of_snapshot(as_of_snapshots, as_of):
+    '''
+    Takes the output of get_as_of_snapshots and a date as parameters.
+    Looks up the row of each country on the last date of the data on
+    or before that date, without scanning the data. Returns pandas
+    dataframe like get_snapshot of only the rows up to that date.
+    '''
+    dates = as_of_snapshots['dates']
+    data = as_of_snapshots['country_index']['data']
+    day = dates.searchsorted(_as_date(dates, as_of), side='right') - 1
+    if day < 0:
+        return(_add_latest_percent(data.iloc[:0].copy()))
+    positions = as_of_snapshots['positions'][day]
+    return(_add_latest_percent(data.take(positions[positions >= 0]).copy()))
+
+
+def get_q2_frames(filtered_data, as_of_snapshots=None, every=1):
+    '''
+    Takes filtered pandas dataframe as a parameter, and optionally the
+    output of get_as_of_snapshots for it and the number of days
+    between frames. Finds the percent vaccinated of each country as of
+    every day, or every few days and the last day, for the frames of a
+    time-lapse of the q2 map, by
+    computing it once for every row and taking the rows of each day
+    from the as-of snapshots. Returns tuple of the pandas index of the
+    dates, the pandas index of the country iso codes, and a numpy array
+    with one row per date and one column per country, with N/A where
+    a country has not started vaccinating.
+    '''
+    if as_of_snapshots is None:
+        as_of_snapshots = get_as_of_snapshots(filtered_data)
+    country_index = as_of_snapshots['country_index']
+    data = country_index['data']
+
+    # same as the snapshot: total vaccinations when people vaccinated
+    # is missing on that day
+    people = data['people_vaccinated'].to_numpy(dtype=float)
+    total = data['total_vaccinations'].to_numpy(dtype=float)
+    people = np.where(people == 0, total, people)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent = people / data['population'].to_numpy(dtype=float) * 100
+    percent = np.append(percent, np.nan).astype(np.float32)
+
+    # every few days, always ending with the last day
+    dates = as_of_snapshots['dates']
+    frames = np.arange(0, len(dates), every)
+    if len(dates) > 0 and frames[-1] != len(dates) - 1:
+        frames = np.append(frames, len(dates) - 1)
+
+    # position -1 takes the N/A added at the end
+    positions = as_of_snapshots['positions'][frames]
+    return(dates[frames], country_index['countries'], percent[positions])
+
+
+def _as_date(dates, as_of):
+    '''
+    Takes index of dates from the data and a date as parameters.
+    Returns the date in the same form as the dates, a timestamp or
+    text such as '2021-02-17'.
+    '''
+    if pd.api.types.is_datetime64_any_dtype(dates.dtype):
+        return(pd.Timestamp(as_of))
+    return(pd.Timestamp(as_of).strftime('%Y-%m-%d'))
+
+
+def get_incremental_data(file_url, state_dir, compact=False, cache_dir=None):
+    '''
+    Takes url of COVID-19 CSV file and a directory to keep the
+    processed state in as parameters, and optionally the compact
+    and cache_dir options of get_filtered_data.
+    Reads the file, then keeps only the rows newer than the latest
+    date already processed for each country. Only those rows are
+    folded into the snapshot of the most recent day for each
+    country, which is stored in the state directory with the latest
+    date of each country, so the work done each day scales with the
+    new data instead of the whole history. Returns tuple of the
+    filtered pandas dataframe read from the file, which has all days,
+    and the snapshot in the same form as get_snapshot.
+    '''
+    meta_path = os.path.join(state_dir, 'meta.pkl')
+    if os.path.exists(meta_path):
+        meta = pd.read_pickle(meta_path)
+    else:
+        meta = {'high_water': pd.Series(dtype=object),
+                'countries': [],
+                'snapshot': None}
+
+    data = get_filtered_data(file_url, compact=compact, cache_dir=cache_dir)
+
+    # keep only rows after the latest date processed for their country
+    high_water = meta['high_water'].reindex(data['iso_code'].astype(object))
+    is_new = high_water.isna().to_numpy().copy()
+    seen = ~is_new
+    is_new[seen] = data['date'].to_numpy()[seen] > \
+        high_water.to_numpy()[seen]
+    new_rows = data[is_new]
+
+    if len(new_rows) > 0:
+        # newest date for each country with new rows
+        new_high_water = new_rows.groupby(new_rows['iso_code'].astype(object),
+                                          sort=False)['date'].max()
+        meta['high_water'] = new_high_water.combine_first(meta['high_water'])
+
+        # countries in the order they first appear in the history
+        known = set(meta['countries'])
+        meta['countries'] = meta['countries'] + \
+            [country for country in new_rows['iso_code'].unique()
+             if country not in known]
+
+        # replace snapshot rows of countries with newer vaccination data
+        new_snapshot = get_snapshot(new_rows)
+        if meta['snapshot'] is None:
+            snapshot = new_snapshot
+        else:
+            old_snapshot = meta['snapshot']
+            old_snapshot = old_snapshot[
+                ~old_snapshot['iso_code'].isin(new_snapshot['iso_code'])]
+            snapshot = pd.concat(_align_categories([old_snapshot,
+                                                    new_snapshot]))
+        meta['snapshot'] = _order_countries(snapshot, meta['countries'])
+
+        os.makedirs(state_dir, exist_ok=True)
+        pd.to_pickle(meta, meta_path)
+
+    # the file already holds every day
+    return(data, meta['snapshot'])
+
+
+def _align_categories(frames):
+    '''
+    Takes list of pandas dataframes with the same columns as a parameter.
+    Gives every categorical column the same categories in all frames,
+    so concatenating them keeps the column categorical. Returns list
+    of pandas dataframes.
+    '''
+    frames = [frame.copy() for frame in frames]
+    for column in frames[0].columns:
+        if not isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            continue
+        categories = frames[0][column].cat.categories
+        for frame in frames[1:]:
+            categories = categories.append(
+                frame[column].cat.categories.difference(categories))
+        for frame in frames:
+            frame[column] = frame[column].cat.set_categories(categories)
+    return(frames)
+
+
+def stream_country_state(file_url, compact=False, chunksize=100000):
+    '''
+    Takes url of COVID-19 CSV file as a parameter, and optionally the
+    compact option of get_filtered_data and the number of rows to
+    read at a time. Reads the file in chunks and folds each chunk
+    into a running state for each country, so memory use depends
+    on the chunk size and number of countries instead of the size
+    of the file. Returns dictionary with the snapshot, in the same
+    form as get_snapshot, and the GDP per capita of each country, in
+    the same form as get_gdp_data.
+    '''
+    latest = None
+    gdp = None
+    countries = []
+    known = set()
+
+    for chunk in _read_chunks(file_url, compact, chunksize):
+        # last row with vaccination data for each country so far
+        vacc_chunk = chunk[chunk['total_vaccinations'] != 0]
+        vacc_chunk = vacc_chunk.groupby('iso_code', sort=False,
+                                        observed=True).tail(1)
+        if latest is not None:
+            vacc_chunk = pd.concat(_align_categories([latest, vacc_chunk]))
+        latest = vacc_chunk.groupby('iso_code', sort=False,
+                                    observed=True).tail(1)
+
+        # countries in the order they first have vaccination data
+        for country in latest['iso_code']:
+            if country not in known:
+                known.add(country)
+                countries.append(country)
+
+        # highest GDP per capita for each country so far
+        chunk_gdp = get_gdp_data(chunk)
+        if gdp is not None:
+            chunk_gdp = get_gdp_data(pd.concat([gdp, chunk_gdp]))
+        gdp = chunk_gdp
+
+    snapshot = _order_countries(get_latest_data(latest), countries)
+    return({'snapshot': snapshot, 'gdp_data': gdp})
+
+
+def read_country_rows(file_url, countries, compact=False, chunksize=100000):
+    '''
+    Takes url of COVID-19 CSV file and a list of country iso codes
+    as parameters, and optionally the compact option of
+    get_filtered_data and the number of rows to read at a time.
+    Reads the file in chunks and keeps only the rows of the given
+    countries. Returns filtered pandas dataframe for those countries.
+    '''
+    country_rows = [chunk[chunk['iso_code'].isin(countries)]
+                    for chunk in _read_chunks(file_url, compact, chunksize)]
+    return(pd.concat(_align_categories(country_rows), ignore_index=True))
+
+
+def get_streamed_q1_df(file_url, state, compact=False, chunksize=100000):
+    '''
+    Takes url of COVID-19 CSV file and the output of
+    stream_country_state for it as parameters, and optionally the
+    compact option of get_filtered_data and the number of rows to
+    read at a time. Reads only the rows of the top 10 countries in
+    a second pass over the file. Returns the same pandas dataframe
+    as get_q1_df.
+    '''
+    snapshot = state['snapshot']
+    top_10_countries = get_top_countries(snapshot)
+    top_10_rows = read_country_rows(file_url, list(top_10_countries),
+                                    compact, chunksize)
+    return(get_q1_df(top_10_rows, snapshot))
+
+
+def _read_chunks(file_url, compact, chunksize):
+    '''
+    Takes url of COVID-19 CSV file, the compact option of
+    get_filtered_data and the number of rows to read at a time as
+    parameters. Yields pandas dataframes of at most that many rows,
+    read and filled the same way as get_filtered_data.
+    '''
+    if compact:
+        reader = pd.read_csv(file_url, usecols=RELEVANT_COLUMNS,
+                             dtype=READ_DTYPES, parse_dates=['date'],
+                             chunksize=chunksize)
+    else:
+        reader = pd.read_csv(file_url, usecols=RELEVANT_COLUMNS,
+                             chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            chunk = chunk[RELEVANT_COLUMNS]
+            if compact:
+                yield _fill_counters(chunk)
+            else:
+                yield chunk.fillna(0)
+
+
+def get_q1_df(filtered_data, snapshot=None, n=10,
+              metric='percent_vaccinated', min_population=1000000,
+              country_index=None, as_of=None, as_of_snapshots=None):
+    '''
+    Takes filtered pandas dataframe as a parameter, and optionally
+    the snapshot from get_snapshot for the same data, the number of
+    countries, the metric from RANKING_METRICS to rank them by, the
+    smallest population of a country, and the output of
+    get_country_index for the same data. If a date is given as
+    as_of, the countries are ranked as of that date, from the
+    output of get_as_of_snapshots when given, and only days up
+    to that date are kept.
+    Uses the vaccination data for the most recent
+    day which each country has data for to take the
+    top 10 countries (or top n) with highest percent
+    vaccinated (or the given metric). Takes the rows
+    of only those countries, but for all days. Calculates
+    percent vaccinated and the metric for all days for
+    those countries. Returns pandas dataframe with
+    percent vaccinated for all days for top countries.
+    '''
+    if as_of_snapshots is not None:
+        country_index = as_of_snapshots['country_index']
+    if country_index is None:
+        country_index = get_country_index(filtered_data)
+    snapshot = _get_question_snapshot(filtered_data, snapshot,
+                                      country_index, as_of, as_of_snapshots)
+
+    top_countries = get_top_countries(snapshot, n, metric, min_population)
+
+    # get rows of the top countries from their slices, grouped by
+    # country in order of the metric, and remove days where total
+    # vaccinations is 0
+    top_df = get_country_rows(country_index, top_countries)
+    if as_of is not None:
+        top_df = top_df[top_df['date'] <= _as_date(top_df['date'], as_of)]
+    top_df = top_df[(top_df['population'] >= min_population) &
+                    (top_df['total_vaccinations'] != 0)].copy()
+
+    # Get top countries with percent vaccinated for all days.
     # Some countries will have some days for people vaccinated but
-    # not all, therefore this is a case by case basis.
-    for country in countries:
-        # one country
-        new_country = df_relevant[df_relevant['iso_code'] == country]
-        # last row for that country
-        max_day = new_country.iloc[[-1]].copy()
-        # replace people vaccinated column if missing
-        if (max_day['people_vaccinated'] == 0).any():
-            max_day['people_vaccinated'] = max_day['total_vaccinations']
-        # calculate percent vaccinated
-        max_day['percent_vaccinated'] = \
-            (max_day['people_vaccinated'] / max_day['population']) * 100
-        # add to new data frame
-        max_date_df = max_date_df.append(max_day)
+    # not all, therefore the whole history of any country missing
+    # people vaccinated on a day is replaced with total vaccinations.
+    missing = (top_df['people_vaccinated'] == 0) \
+        .groupby(top_df['iso_code'], observed=True).transform('any')
+    top_df.loc[missing, 'people_vaccinated'] = \
+        top_df.loc[missing, 'total_vaccinations']
+
+    # calculate percent vaccinated, and the ranking metric
+    top_df['percent_vaccinated'] = \
+        top_df['people_vaccinated'] / top_df['population'] * 100
+    top_df = _add_metric(top_df, metric)
+
+    return(top_df)
+
+
+# metrics countries can be ranked by, with the column counted
+# per hundred people
+RANKING_METRICS = {'percent_vaccinated': 'people_vaccinated',
+                   'percent_fully_vaccinated': 'people_fully_vaccinated',
+                   'doses_per_hundred': 'total_vaccinations'}
+
+
+def _get_question_snapshot(filtered_data, snapshot, country_index, as_of,
+                           as_of_snapshots):
+    '''
+    Takes the data and the optional snapshot, country index, date and
+    output of get_as_of_snapshots given to a question function as
+    parameters. Returns the given snapshot, which must then be as of
+    the date, or else the snapshot as of the date if one is given,
+    or else a new snapshot.
+    '''
+    if snapshot is not None:
+        return(snapshot)
+    if as_of is not None:
+        if as_of_snapshots is None:
+            as_of_snapshots = get_as_of_snapshots(filtered_data,
+                                                  country_index)
+        return(get_as_of_snapshot(as_of_snapshots, as_of))
+    return(get_snapshot(filtered_data, country_index))
+
+
+def get_top_countries(snapshot, n=10, metric='percent_vaccinated',
+                      min_population=1000000):
+    '''
+    Takes snapshot from get_snapshot as a parameter, and optionally
+    the number of countries, the metric from RANKING_METRICS to rank
+    them by, and the smallest population of a country. Selects the
+    top countries with a partial selection instead of sorting every
+    country. Returns pandas series with iso codes of the top countries,
+    in order of the metric.
+    '''
+    # remove countries under the population threshold,
+    # population is the same for all rows of a country
+    max_date_df = snapshot[snapshot['population'] >= min_population]
 
     # remove row for world
     max_date_df = max_date_df[max_date_df['location'] != 'World']
@@ -83,37 +793,223 @@ def get_q1_df(filtered_data):
     # remove countries where total cases are 0
     max_date_df = max_date_df[max_date_df['total_cases'] != 0]
 
-    # get top 10 sorted by percent vaccinated
-    top_10 = max_date_df.sort_values(by='percent_vaccinated',
-                                     ascending=False).head(10)
-    top_10_countries = top_10['iso_code']
+    # get top n by the metric
+    max_date_df = _add_metric(max_date_df.copy(), metric)
+    top = max_date_df.nlargest(n, metric)
+    return(top['iso_code'])
 
-    # get slice of original data frame that contains the top 10 countries
-    top_10_df = df_relevant[df_relevant['iso_code'].isin(top_10_countries)]
 
-    # Get top 10 countries with percent vaccinated for all days.
-    # For each country you must check if people vaccinated is zero.
-    # Some countries will have some days for people vaccinated but
-    # not all, therefore it needs to be replaced with total vaccinations.
-    for country in top_10_countries:
-        # create new country
-        new_country = top_10_df[top_10_df['iso_code'] == country].copy()
-        # if missing people vaccinated, replace with total vaccinations value
-        if (new_country['people_vaccinated'] == 0).any():
-            new_country['people_vaccinated'] = \
-                new_country['total_vaccinations']
-        # calculate percent vaccinated
-        new_country['percent_vaccinated'] = \
-            new_country['people_vaccinated'] / new_country['population'] * 100
-        # add to data frame
-        adjusted_top_10_df = adjusted_top_10_df.append(new_country)
-
-    return(adjusted_top_10_df)
-
-
-def get_q2_map_df(filtered_data):
-    '''
-    Takes a filtered dataset as a parameter. Filters it down
+def _add_metric(df, metric):
+    '''
+    Takes pandas dataframe with percent vaccinated and the name of a
+    metric from RANKING_METRICS as parameters. Adds a column with the
+    metric if it is not there yet. Returns pandas dataframe.
+    '''
+    if metric not in RANKING_METRICS:
+        raise ValueError('Unknown ranking metric: ' + metric)
+    if metric not in df.columns:
+        df[metric] = df[RANKING_METRICS[metric]] / df['population'] * 100
+    return(df)
+
+
+def get_country_index(filtered_data, country_slices=None):
+    '''
+    Takes filtered pandas dataframe as a parameter. Sorts the rows by
+    country, in the order countries first appear, and by date within
+    each country, and finds the offset of the first row of each
+    country, so the rows of any country are one slice of the sorted
+    rows. Built once after reading the data, it lets the question
+    functions take countries, or their first or last rows, without
+    scanning the dataframe again. If the dictionary from each country
+    to the slice of its rows, such as from
+    final_project_cache.load_columns, is also given, the rows are
+    already grouped by country, so they are only sorted again if
+    their days are out of order. Returns dictionary with the sorted
+    pandas dataframe under 'data', a pandas index of the iso codes
+    under 'countries', and a numpy array of offsets, one longer than
+    the countries, under 'offsets'.
+    '''
+    date_codes = pd.factorize(filtered_data['date'], sort=True)[0]
+    if country_slices is None:
+        country_codes, countries = pd.factorize(
+            filtered_data['iso_code'].astype(object))
+        order = np.lexsort((date_codes, country_codes))
+        offsets = np.zeros(len(countries) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(country_codes, minlength=len(countries)),
+                  out=offsets[1:])
+        return({'data': filtered_data.take(order),
+                'countries': pd.Index(countries),
+                'offsets': offsets})
+
+    countries = list(country_slices)
+    offsets = np.array([0] + [rows.stop for rows in
+                              country_slices.values()], dtype=np.int64)
+    # steps back in date that are not between two countries
+    backwards = np.diff(date_codes) < 0
+    backwards[offsets[1:-1] - 1] = False
+    if backwards.any():
+        country_codes = np.repeat(np.arange(len(countries)),
+                                  np.diff(offsets))
+        filtered_data = filtered_data.take(
+            np.lexsort((date_codes, country_codes)))
+    return({'data': filtered_data,
+            'countries': pd.Index(countries, dtype=object),
+            'offsets': offsets})
+
+
+def get_country_rows(country_index, countries):
+    '''
+    Takes the output of get_country_index and a list of iso codes as
+    parameters. Joins the slices of those countries, leaving out codes
+    that are not in the data. Returns pandas dataframe with the rows
+    of each country in the order of the list.
+    '''
+    positions = country_index['countries'].get_indexer(list(countries))
+    positions = positions[positions >= 0]
+    offsets = country_index['offsets']
+    rows = [np.arange(offsets[position], offsets[position + 1])
+            for position in positions]
+    return(country_index['data'].take(
+        np.concatenate(rows + [np.array([], dtype=np.int64)])))
+
+
+def get_first_rows(country_index):
+    '''
+    Takes the output of get_country_index as a parameter. Returns
+    pandas dataframe with the earliest row of each country.
+    '''
+    return(country_index['data'].take(country_index['offsets'][:-1]))
+
+
+def get_last_rows(country_index):
+    '''
+    Takes the output of get_country_index as a parameter. Returns
+    pandas dataframe with the most recent row of each country.
+    '''
+    return(country_index['data'].take(country_index['offsets'][1:] - 1))
+
+
+def downsample_q1_df(q1_df, points=200, method='lttb'):
+    '''
+    Takes pandas dataframe from get_q1_df as a parameter, and optionally
+    the number of points to keep for each country and the method.
+    Countries with more days than that are reduced to about that many
+    rows, keeping the shape of their percent vaccinated curve, so the
+    plot stays responsive over long date ranges. The method is either
+    'lttb' (Largest-Triangle-Three-Buckets) or 'minmax', which keeps
+    the lowest and highest day of each bucket of days. Returns pandas
+    dataframe with a subset of the rows, in the same order.
+    '''
+    # rows of each country are next to each other in q1_df
+    x = pd.to_datetime(q1_df['date']).to_numpy().astype('datetime64[D]')
+    x = x.astype(float)
+    y = q1_df['percent_vaccinated'].to_numpy(dtype=float)
+    country = pd.factorize(q1_df['iso_code'])[0]
+    starts = np.flatnonzero(np.r_[True, country[1:] != country[:-1]])
+    lengths = np.diff(np.r_[starts, len(country)])
+
+    if method == 'lttb':
+        keep = _lttb_positions(x, y, starts, lengths, points)
+    elif method == 'minmax':
+        keep = _minmax_positions(y, starts, lengths, points)
+    else:
+        raise ValueError('Unknown downsampling method: ' + method)
+
+    return(q1_df.iloc[np.unique(keep)])
+
+
+def _lttb_positions(x, y, starts, lengths, points):
+    '''
+    Takes x and y values of all rows, the first row and number of rows
+    of each country, and the number of points to keep as parameters.
+    Picks points with Largest-Triangle-Three-Buckets for all countries
+    at once, one bucket at a time. Returns numpy array of positions of
+    the rows to keep.
+    '''
+    # countries short enough are kept whole
+    short = lengths <= max(points, 2)
+    keep = [np.arange(start, start + length)
+            for start, length in zip(starts[short], lengths[short])]
+    starts = starts[~short]
+    lengths = lengths[~short]
+    if len(starts) == 0 or points < 3:
+        keep.extend([starts, starts + lengths - 1])
+        return(np.concatenate(keep))
+
+    # sums of x and y to average the next bucket in constant time
+    x_sums = np.r_[0, np.cumsum(x)]
+    y_sums = np.r_[0, np.cumsum(y)]
+
+    # first and last row are always kept, the rows between them
+    # are split into points - 2 buckets
+    last = starts + lengths - 1
+    bucket_size = (lengths - 2) / (points - 2)
+    selected = starts
+    keep.extend([starts, last])
+    for bucket in range(points - 2):
+        bucket_start = starts + 1 + np.floor(bucket * bucket_size)
+        bucket_end = starts + 1 + np.floor((bucket + 1) * bucket_size)
+        bucket_start = bucket_start.astype(int)
+        bucket_end = np.minimum(bucket_end.astype(int), last)
+
+        # average of the next bucket, or the last row after the last one
+        next_end = starts + 1 + np.floor((bucket + 2) * bucket_size)
+        next_end = np.minimum(next_end.astype(int), last)
+        next_start = np.where(bucket == points - 3, last, bucket_end)
+        next_end = np.where(bucket == points - 3, last + 1,
+                            np.maximum(next_end, next_start + 1))
+        count = next_end - next_start
+        x_next = (x_sums[next_end] - x_sums[next_start]) / count
+        y_next = (y_sums[next_end] - y_sums[next_start]) / count
+
+        # row of the bucket making the largest triangle with the last
+        # selected row and the average of the next bucket
+        width = max(int((bucket_end - bucket_start).max()), 1)
+        candidates = bucket_start[:, None] + np.arange(width)[None, :]
+        valid = candidates < bucket_end[:, None]
+        candidates = np.where(valid, candidates, bucket_start[:, None])
+        x_a = x[selected][:, None]
+        y_a = y[selected][:, None]
+        area = np.abs((x_a - x_next[:, None]) * (y[candidates] - y_a) -
+                      (x_a - x[candidates]) * (y_next[:, None] - y_a))
+        area = np.where(valid, area, -1)
+        selected = candidates[np.arange(len(starts)), area.argmax(axis=1)]
+        keep.append(selected)
+
+    return(np.concatenate(keep))
+
+
+def _minmax_positions(y, starts, lengths, points):
+    '''
+    Takes y values of all rows, the first row and number of rows of
+    each country, and the number of points to keep as parameters.
+    Splits the rows of each country into points / 2 buckets and keeps
+    the lowest and highest row of each bucket, plus the first and last
+    row of the country. Returns numpy array of positions of the rows
+    to keep.
+    '''
+    buckets = max(points // 2, 1)
+    lengths_by_row = np.repeat(lengths, lengths)
+    starts_by_row = np.repeat(starts, lengths)
+    position = np.arange(len(y))
+    bucket = (position - starts_by_row) * buckets // lengths_by_row
+
+    # one key for each bucket of each country
+    key = starts_by_row * buckets + bucket
+    rows = pd.DataFrame({'key': key, 'y': y})
+    grouped = rows.groupby('key', sort=False)['y']
+    return(np.concatenate([grouped.idxmin().to_numpy(),
+                           grouped.idxmax().to_numpy(),
+                           starts, starts + lengths - 1]))
+
+
+def get_q2_map_df(filtered_data, snapshot=None, country_index=None,
+                  as_of=None, as_of_snapshots=None):
+    '''
+    Takes a filtered dataset as a parameter, and optionally the
+    snapshot from get_snapshot and the output of get_country_index
+    for the same data, and a date with the output of
+    get_as_of_snapshots to map the data as of that date. Filters it down
     to contain only relevant data to analysis. New dataset
     is used to calculate each country's percentage of vaccination.
     Percentage calculated takes the number of people that have been
@@ -122,97 +1018,50 @@ def get_q2_map_df(filtered_data):
     Percentage per country is merged with geometrical data of the
     world and returned.
     '''
-    # Filter only for columns needed to plot map
-    q2_df = filtered_data[['iso_code',
-                           'continent',
-                           'location',
-                           'date',
-                           'people_vaccinated',
-                           'total_vaccinations',
-                           'population']]
-
     # Removing days that portray total vaccinations
     # as 0 to prevent illogical data spikes
     # Some countries that have not yet started issuing vaccines will also
     # be removed from this analysis
-    q2_df = q2_df[q2_df['total_vaccinations'] != 0]
-
-    # Create blank dataframe to store latest dates that contain relevant data
-    latest_data = pd.DataFrame(columns=q2_df.columns)
-
-    # Get a list of all country iso codes
-    countries = q2_df['iso_code'].unique()
-
-    for country in countries:
-        new_country = q2_df[q2_df['iso_code'] == country]
-        # Latest data for that country
-        recent_day = new_country.iloc[[-1]].copy()
-        # Replace people vaccinated data with total vaccinated if missing
-        if (recent_day['people_vaccinated'] == 0).any():
-            recent_day['people_vaccinated'] = recent_day['total_vaccinations']
-        # Calculate percent vaccinated for country
-        recent_day['percent_vaccinated'] = \
-            (recent_day['people_vaccinated'] / recent_day['population']) * 100
-        # Add data to dataframe
-        latest_data = latest_data.append(recent_day)
+    snapshot = _get_question_snapshot(filtered_data, snapshot,
+                                      country_index, as_of, as_of_snapshots)
+
+    # Filter only for columns needed to plot map
+    latest_data = snapshot[['iso_code',
+                            'continent',
+                            'location',
+                            'date',
+                            'people_vaccinated',
+                            'total_vaccinations',
+                            'population',
+                            'percent_vaccinated']]
 
     # Remove world row
     latest_data = latest_data[latest_data['location'] != 'World']
 
-    # load geopandas built-in variable for country shapes
-    world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
-
-    # Fill in missing iso codes for countries in world data
-    world.loc[world['name'] == 'Norway', 'iso_a3'] = 'NOR'
-    world.loc[world['name'] == 'France', 'iso_a3'] = 'FRA'
-    world.loc[world['name'] == 'N. Cyprus', 'iso_a3'] = 'OWID_NCY'
-    world.loc[world['name'] == 'Somaliland', 'iso_a3'] = 'SOM'
-    world.loc[world['name'] == 'Kosovo', 'iso_a3'] = 'OWID_KOS'
-
-    # Combining world geopanda dataset with vaccine dataset's latest data
-    merged_df = latest_data.merge(world,
-                                  left_on='iso_code',
-                                  right_on='iso_a3',
-                                  how='left')
-    merged_df = GeoDataFrame(merged_df)
+    # Combining country shapes with vaccine dataset's latest data,
+    # countries without a shape are reported and kept without one
+    merged_df = final_project_geometry.join_world(latest_data)
 
     return(merged_df)
 
 
-def get_q3_xy_df(filtered_data):
+def get_q3_xy_df(filtered_data, snapshot=None, country_index=None,
+                 as_of=None, as_of_snapshots=None):
     '''
-    Takes filtered pandas dataframe as a parameter.
+    Takes filtered pandas dataframe as a parameter, and optionally
+    the snapshot from get_snapshot and the output of
+    get_country_index for the same data, and a date with the output
+    of get_as_of_snapshots to use the data as of that date.
     Creates new pandas dataframe with same columns which
     contains the vaccination data for the most recent
     day which each country has data for.
     Returns new pandas dataframe.
     '''
-    # remove rows where total vaccinations is 0
-    df_3_vacc = filtered_data[filtered_data['total_vaccinations'] != 0]
-
-    # create new dataframe to add rows to
-    df_recent_date = pd.DataFrame(columns=df_3_vacc.columns)
-
-    # get list of all country iso codes
-    countries_3 = df_3_vacc['iso_code'].unique()
-
     # Get vaccination percentage for all
     # countries on most recent day.
-    # Find most recent day for each country, then
-    # calculate percent vaccinated and add to dataframe
-    for country in countries_3:
-        # one country
-        new = df_3_vacc[df_3_vacc['iso_code'] == country]
-        # last row for that country
-        recent_day = new.iloc[[-1]].copy()
-        # replace people vaccinated column if missing
-        if (recent_day['people_vaccinated'] == 0).any():
-            recent_day['people_vaccinated'] = recent_day['total_vaccinations']
-        # calculate percent vaccinated
-        recent_day['percent_vaccinated'] = \
-            (recent_day['people_vaccinated'] / recent_day['population']) * 100
-        # add to dataframe
-        df_recent_date = df_recent_date.append(recent_day)
+    snapshot = _get_question_snapshot(filtered_data, snapshot,
+                                      country_index, as_of, as_of_snapshots)
+    df_recent_date = snapshot
 
     # remove rows where gdp per capita is 0
     df_recent_date = df_recent_date[df_recent_date['gdp_per_capita'] != 0]
@@ -220,44 +1069,69 @@ def get_q3_xy_df(filtered_data):
     return(df_recent_date)
 
 
-def get_q3_map_df(filtered_data):
+def get_gdp_data(filtered_data, country_index=None, country_data=None):
     '''
-    Takes filtered pandas dataframe as a parameter.
+    Takes filtered pandas dataframe as a parameter, and optionally
+    the output of get_country_index for it, or the country table
+    from split_country_data, which is used instead of the filtered
+    data when given.
     Filters for only country iso code (3 letter identifier)
-    and GDP per capita. Loads geopandas built-in dataframe,
-    and manually replaces missing iso codes. Manually adds
-    iso code and GDP per capita for Turkmenistan. Merges
-    dataframes based on country iso code using keys from the
-    GDP per capita dataframe. Converts to GeoDataFrame.
-    Returns GeoDataFrame.
+    and GDP per capita, with one row for each country sorted
+    by iso code. Returns pandas dataframe.
     '''
-    # Plotting GDP Per Capita Choropleth Map
+    if country_data is not None:
+        # one row per country already
+        df_3_gdp = country_data[['iso_code', 'gdp_per_capita']].copy()
+        df_3_gdp['iso_code'] = df_3_gdp['iso_code'].astype(object)
+        return(df_3_gdp.sort_values('iso_code', ignore_index=True))
+
+    if country_index is not None and len(country_index['countries']) > 0:
+        # largest value within the slice of each country
+        gdp = country_index['data']['gdp_per_capita'].to_numpy()
+        df_3_gdp = pd.DataFrame({
+            'iso_code': country_index['countries'].astype(object),
+            'gdp_per_capita': np.maximum.reduceat(
+                gdp, country_index['offsets'][:-1])})
+        return(df_3_gdp.sort_values('iso_code', ignore_index=True))
+
     df_3_gdp = filtered_data[['iso_code', 'gdp_per_capita']]
 
     # take one row from each country
     # gdp per capita is the same for all rows of a country
     # but taking the max to be sure
-    df_3_gdp = df_3_gdp.groupby(by='iso_code').max()
+    df_3_gdp = df_3_gdp.groupby(by='iso_code', observed=True).max()
     df_3_gdp.reset_index(inplace=True)
+    df_3_gdp['iso_code'] = df_3_gdp['iso_code'].astype(object)
+
+    return(df_3_gdp)
+
 
-    # load geopandas built-in variable for country shapes
-    world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
+def get_q3_map_df(filtered_data, gdp_data=None, country_index=None,
+                  country_data=None):
+    '''
+    Takes filtered pandas dataframe as a parameter, and optionally
+    the output of get_gdp_data or stream_country_state for it, the
+    output of get_country_index for it, or the country table from
+    split_country_data, in which case filtered_data can be None.
+    Filters for only country iso code (3 letter identifier)
+    and GDP per capita. Manually adds iso code and GDP
+    per capita for Turkmenistan. Joins the country shapes
+    to the GDP per capita dataframe by iso code.
+    Returns GeoDataFrame.
+    '''
+    # Plotting GDP Per Capita Choropleth Map
+    if gdp_data is None:
+        gdp_data = get_gdp_data(filtered_data, country_index,
+                                country_data)
+    df_3_gdp = gdp_data.copy()
 
-    # Manually enter missing iso codes and missing rows to fill in map
-    world.iloc[43, 3] = 'FRA'
-    world.iloc[21, 3] = 'NOR'
-    world.iloc[174, 3] = 'KOS'
-    df_3_gdp.iloc[150, 0] = 'KOS'
+    # Manually add missing row to fill in map
     tkm_row = pd.DataFrame({'iso_code': ['TKM'],
                             'gdp_per_capita': [6966.64]})
-    df_3_gdp = df_3_gdp.append(tkm_row)
-
-    # merge dataframes using iso codes from COVID data frame
-    # and convert to geodataframe
-    merged_world_df = df_3_gdp.merge(world,
-                                     how='left',
-                                     left_on='iso_code',
-                                     right_on='iso_a3')
-    merged_world_df = GeoDataFrame(merged_world_df)
+    df_3_gdp = pd.concat([df_3_gdp, tkm_row])
+
+    # join country shapes using iso codes from COVID data frame,
+    # countries without a shape are reported and kept without one
+    merged_world_df = final_project_geometry.join_world(df_3_gdp)
 
     return(merged_world_df)
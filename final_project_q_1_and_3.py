@@ -11,13 +11,12 @@ import json
 import seaborn as sns
 import matplotlib.pyplot as plt
 from geopandas import GeoDataFrame
+import final_project_processing_163
+import final_project_cache
 
-df_3 = pd.read_csv('https://covid.ourworldindata.org/data/owid-covid-data.csv?v=2021-02-17').fillna(0)
-
-df_3 = df_3[['iso_code', 'continent', 'location',
-             'date', 'total_cases', 'total_vaccinations',
-             'people_vaccinated', 'people_fully_vaccinated',
-             'new_vaccinations', 'population', 'gdp_per_capita']]
+df_3 = final_project_processing_163.get_filtered_data(
+    'https://covid.ourworldindata.org/data/owid-covid-data.csv?v=2021-02-17',
+    cache_dir=final_project_cache.CACHE_DIR)
 
 
 ## Plotting GDP Per Capita vs Percentage Vaccinated
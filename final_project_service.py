@@ -0,0 +1,295 @@
+'''
+Matthew Friedrich
+CSE 163 Section AG
+
+This file contains the functions load_state, answer, and serve,
+and a main function to run serve from the command line. serve is a
+small HTTP service, built on asyncio, that answers questions about
+the COVID-19 dataset acquired from Our World in Data as JSON. The
+data is processed once with final_project_processing_163.py and
+kept in memory with its country index and snapshot, so each query
+only reads the rows it needs. Many clients can be served at once,
+and the data is loaded again in the background when the dataset
+changes. For example,
+
+    python final_project_service.py --port 8163
+    curl 'localhost:8163/top?n=5&metric=percent_fully_vaccinated'
+
+The queries are:
+
+    /latest?country=ISR            most recent day of a country
+    /top?n=10&metric=...&min_population=...
+                                   top countries, as in the q1 plot
+    /gdp                           GDP per capita and percent
+                                   vaccinated, as in the q3 plot
+    /series?country=ISR&start=2021-01-01&end=2021-02-01
+                                   days of a country between dates
+    /status                        hash of the loaded dataset
+'''
+
+
+import argparse
+import asyncio
+import json
+import time
+import urllib.parse
+import pandas as pd
+import final_project_cache
+import final_project_processing_163
+
+
+DATA_URL = ('https://covid.ourworldindata.org/data/'
+            'owid-covid-data.csv?v=2021-02-17')
+
+# columns of the snapshot returned by /latest, /top and /gdp
+LATEST_COLUMNS = ['iso_code', 'location', 'date', 'people_vaccinated',
+                  'total_vaccinations', 'population', 'percent_vaccinated']
+GDP_COLUMNS = ['iso_code', 'location', 'percent_vaccinated',
+               'gdp_per_capita', 'total_cases']
+
+# status line of each response code used
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+          405: 'Method Not Allowed'}
+
+
+def load_state(file_url=DATA_URL, cache_dir=final_project_cache.CACHE_DIR):
+    '''
+    Takes optionally url of COVID-19 CSV file and the cache directory
+    as parameters. Fetches the file through the cache, reads it in
+    compact mode and builds the country index and snapshot the
+    queries are answered from. Returns dictionary of the state.
+    '''
+    path, digest = final_project_cache.fetch_file(file_url, cache_dir)
+    # the url was just fetched, so fetching it again in
+    # get_filtered_data only revalidates it instead of hashing the
+    # cached copy as a new file
+    data = final_project_processing_163.get_filtered_data(
+        file_url, compact=True, cache_dir=cache_dir)
+    country_index = final_project_processing_163.get_country_index(data)
+    snapshot = final_project_processing_163.get_snapshot(data,
+                                                         country_index)
+    return({'digest': digest,
+            'loaded': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'rows': len(data),
+            'data': data,
+            'country_index': country_index,
+            'snapshot': snapshot.set_index(
+                snapshot['iso_code'].astype(object), drop=False)})
+
+
+def answer(state, target):
+    '''
+    Takes state from load_state and the path of a request with its
+    query string as parameters. Answers the query. Returns tuple of
+    the response code and the JSON text of the response.
+    '''
+    url = urllib.parse.urlsplit(target)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    try:
+        if url.path == '/latest':
+            return(_answer_latest(state, query))
+        if url.path == '/top':
+            return(_answer_top(state, query))
+        if url.path == '/gdp':
+            gdp_df = final_project_processing_163.get_q3_xy_df(
+                state['data'], state['snapshot'])
+            return(200, _to_json(gdp_df[GDP_COLUMNS]))
+        if url.path == '/series':
+            return(_answer_series(state, query))
+        if url.path == '/status':
+            return(200, json.dumps({'digest': state['digest'],
+                                    'loaded': state['loaded'],
+                                    'rows': state['rows']}))
+    except KeyError as error:
+        return(400, json.dumps({'error': 'Missing query parameter: ' +
+                                         error.args[0]}))
+    except ValueError as error:
+        return(400, json.dumps({'error': str(error)}))
+    return(404, json.dumps({'error': 'Unknown query: ' + url.path}))
+
+
+def _answer_latest(state, query):
+    '''
+    Takes state from load_state and the query parameters as
+    parameters. Returns tuple of the response code and JSON text
+    with the most recent day of the country.
+    '''
+    country = query['country']
+    if country not in state['snapshot'].index:
+        return(404, json.dumps({'error': 'No vaccinations for ' + country}))
+    latest = state['snapshot'].loc[[country], LATEST_COLUMNS]
+    return(200, _to_json(latest)[1:-1])
+
+
+def _answer_top(state, query):
+    '''
+    Takes state from load_state and the query parameters as
+    parameters. Returns tuple of the response code and JSON text
+    with the snapshot rows of the top countries by the metric.
+    '''
+    metric = query.get('metric', 'percent_vaccinated')
+    top_countries = final_project_processing_163.get_top_countries(
+        state['snapshot'], int(query.get('n', 10)), metric,
+        float(query.get('min_population', 1000000)))
+    top_df = state['snapshot'].loc[top_countries.astype(object),
+                                   LATEST_COLUMNS].copy()
+    if metric not in top_df.columns:
+        column = final_project_processing_163.RANKING_METRICS[metric]
+        top_df[metric] = state['snapshot'].loc[top_df.index, column] / \
+            top_df['population'] * 100
+    return(200, _to_json(top_df))
+
+
+def _answer_series(state, query):
+    '''
+    Takes state from load_state and the query parameters as
+    parameters. Returns tuple of the response code and JSON text
+    with the days of the country between the start and end dates,
+    including both.
+    '''
+    country = query['country']
+    series = final_project_processing_163.get_country_rows(
+        state['country_index'], [country])
+    if len(series) == 0:
+        return(404, json.dumps({'error': 'No data for ' + country}))
+
+    # the country is one short slice, so only it is compared
+    dates = pd.to_datetime(series['date'])
+    keep = (dates >= pd.Timestamp(query.get('start', dates.min()))) & \
+        (dates <= pd.Timestamp(query.get('end', dates.max())))
+    return(200, _to_json(series[keep]))
+
+
+def _to_json(df):
+    '''
+    Takes pandas dataframe as a parameter. Returns JSON text of a
+    list with one object per row, dates written as YYYY-MM-DD.
+    '''
+    df = df.copy()
+    if 'date' in df.columns:
+        df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return(df.to_json(orient='records'))
+
+
+async def serve(file_url=DATA_URL, host='127.0.0.1', port=8163,
+                cache_dir=final_project_cache.CACHE_DIR, reload_seconds=600):
+    '''
+    Takes optionally url of COVID-19 CSV file, the address and port to
+    listen on, the cache directory, and the seconds between checks for
+    a new version of the dataset as parameters. Loads the data, then
+    answers requests until cancelled. Loading happens in a worker
+    thread, so queries are answered with the old data until the new
+    data is ready and swapped in.
+    '''
+    loop = asyncio.get_running_loop()
+    holder = {'state': await loop.run_in_executor(None, load_state,
+                                                  file_url, cache_dir)}
+
+    async def handle(reader, writer):
+        await _handle_client(holder, reader, writer)
+
+    server = await asyncio.start_server(handle, host, port)
+    reloader = asyncio.ensure_future(
+        _reload(holder, file_url, cache_dir, reload_seconds))
+    print('Serving on http://%s:%d' % (host, port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        reloader.cancel()
+
+
+async def _handle_client(holder, reader, writer):
+    '''
+    Takes dictionary holding the current state, and the stream reader
+    and writer of a client as parameters. Reads HTTP requests and
+    writes their answers until the client closes the connection or
+    asks to.
+    '''
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) != 3:
+                break
+            method, target, version = parts
+            if method != 'GET':
+                code, body = 405, json.dumps({'error': 'Only GET'})
+            else:
+                # the state is read once, a reload cannot change it
+                # in the middle of a query
+                code, body = answer(holder['state'], target)
+
+            keep_alive = version == 'HTTP/1.1' and \
+                headers.get('connection', '').lower() != 'close'
+            body = body.encode()
+            writer.write(('HTTP/1.1 %d %s\r\n'
+                          'Content-Type: application/json\r\n'
+                          'Content-Length: %d\r\n'
+                          'Connection: %s\r\n\r\n' % (
+                              code, STATUS[code], len(body),
+                              'keep-alive' if keep_alive else 'close')
+                          ).encode() + body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def _reload(holder, file_url, cache_dir, reload_seconds):
+    '''
+    Takes dictionary holding the current state, url of COVID-19 CSV
+    file, the cache directory and the seconds between checks as
+    parameters. Checks the dataset for a new version every
+    reload_seconds, and when its hash changed swaps in a newly
+    loaded state.
+    '''
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(reload_seconds)
+        try:
+            path, digest = await loop.run_in_executor(
+                None, final_project_cache.fetch_file, file_url, cache_dir)
+            if digest != holder['state']['digest']:
+                holder['state'] = await loop.run_in_executor(
+                    None, load_state, file_url, cache_dir)
+                print('Reloaded dataset', digest[:12])
+        except Exception as error:
+            # keep serving the data already loaded
+            print('Reload failed:', error)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Answer queries about the COVID-19 dataset over HTTP.')
+    parser.add_argument('--url', default=DATA_URL)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8163)
+    parser.add_argument('--reload-seconds', type=float, default=600,
+                        help='seconds between checks for a new dataset')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.url, args.host, args.port,
+                          reload_seconds=args.reload_seconds))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
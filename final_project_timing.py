@@ -0,0 +1,175 @@
+'''
+Matthew Friedrich
+CSE 163 Section AG
+
+This file contains the functions enable, is_enabled, stage,
+add_hook, add_records, get_report, print_report, write_report,
+and reset. They record the wall time, CPU time, number of rows and
+the peak memory of the process so far at the end of each stage of
+the pipeline in
+final_project_processing_163.py and final_project_plotting.py,
+such as downloading, parsing, building the snapshot, loading the
+country shapes, joining and saving.
+Recording is off by default, and stage then does almost nothing.
+'''
+
+
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak memory is then left out
+    resource = None
+
+
+_enabled = False
+_records = []
+_hooks = []
+
+
+class _Stage:
+    '''
+    Context manager that records one stage of the pipeline when it
+    exits. The record is a dictionary, so the code being measured can
+    add the number of rows it handled under 'rows'.
+    '''
+
+    def __init__(self, name, rows):
+        self.record = {'stage': name, 'rows': rows}
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return(self.record)
+
+    def __exit__(self, *exc_info):
+        self.record['wall_seconds'] = time.perf_counter() - self._wall
+        self.record['cpu_seconds'] = time.process_time() - self._cpu
+        # highest memory of the whole process up to now, a running
+        # maximum rather than the peak of this stage alone
+        self.record['process_peak_rss_bytes'] = _get_peak_rss()
+        _records.append(self.record)
+        for hook in _hooks:
+            hook(self.record)
+        return(False)
+
+
+class _NoStage:
+    '''
+    Context manager used while recording is off. Does nothing, and
+    gives a dictionary that is never read for rows to be added to.
+    '''
+
+    def __enter__(self):
+        return({})
+
+    def __exit__(self, *exc_info):
+        return(False)
+
+
+_NO_STAGE = _NoStage()
+
+
+def enable(enabled=True):
+    '''
+    Takes optionally whether to record stages as a parameter.
+    Turns recording on, or off when enabled is False.
+    '''
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    '''
+    Returns whether stages are being recorded.
+    '''
+    return(_enabled)
+
+
+def stage(name, rows=None):
+    '''
+    Takes name of a stage of the pipeline as a parameter, and
+    optionally the number of rows it handles. Returns a context
+    manager that records the stage around the code it wraps, or
+    one that does nothing while recording is off.
+    '''
+    if not _enabled:
+        return(_NO_STAGE)
+    return(_Stage(name, rows))
+
+
+def add_hook(hook):
+    '''
+    Takes a function as a parameter. The function is called with the
+    dictionary of each stage when it is recorded, so the numbers can
+    be sent to another metrics system.
+    '''
+    _hooks.append(hook)
+
+
+def add_records(records):
+    '''
+    Takes list of stage dictionaries recorded in another process, such
+    as a worker of render_outputs, as a parameter. Adds them to the
+    records of this process, and passes them to the hooks.
+    '''
+    for record in records:
+        _records.append(record)
+        for hook in _hooks:
+            hook(record)
+
+
+def get_report():
+    '''
+    Returns list of the dictionaries of all recorded stages, in the
+    order they finished.
+    '''
+    return(list(_records))
+
+
+def print_report():
+    '''
+    Prints a table of all recorded stages. The peak memory is that of
+    the process up to the end of each stage.
+    '''
+    print('%-24s %10s %10s %12s %10s' %
+          ('stage', 'wall s', 'cpu s', 'proc peak MB', 'rows'))
+    for record in _records:
+        peak = record['process_peak_rss_bytes']
+        print('%-24s %10.3f %10.3f %12s %10s' % (
+            record['stage'], record['wall_seconds'], record['cpu_seconds'],
+            '-' if peak is None else '%.1f' % (peak / 1e6),
+            '-' if record['rows'] is None else record['rows']))
+
+
+def write_report(path):
+    '''
+    Takes path of a JSON file as a parameter. Writes all recorded
+    stages to the file.
+    '''
+    with open(path, 'w') as file:
+        json.dump(_records, file, indent=2)
+
+
+def reset():
+    '''
+    Removes all recorded stages.
+    '''
+    del _records[:]
+
+
+def _get_peak_rss():
+    '''
+    Returns the highest resident memory of this process so far in
+    bytes, or None where it cannot be measured.
+    '''
+    if resource is None:
+        return(None)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform != 'darwin':
+        peak = peak * 1024
+    return(peak)
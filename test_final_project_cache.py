@@ -0,0 +1,121 @@
+'''
+Matthew Friedrich
+CSE 163 Section AG
+
+This file contains tests for fetch_file in final_project_cache.py,
+run with pytest against a small HTTP server on this machine.
+'''
+
+
+import hashlib
+import http.server
+import os
+import threading
+import pytest
+import final_project_cache
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    '''
+    Serves the body in the server's files dictionary for each path,
+    with an ETag of its hash, and answers 304 when the client already
+    has that version. Counts the responses of each code.
+    '''
+
+    def do_GET(self):
+        body = self.server.files[self.path]
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+        if self.headers.get('If-None-Match') == etag:
+            self.server.codes.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.server.codes.append(200)
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    '''
+    Starts the HTTP server in a thread. Yields the server, with the
+    files it serves and the codes it answered, and stops it after
+    the test.
+    '''
+    server = http.server.HTTPServer(('127.0.0.1', 0), _Handler)
+    server.files = {'/owid.csv': b'iso_code,date\nAFG,2021-01-01\n'}
+    server.codes = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:%d' % server.server_port
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_revalidates_with_etag(server, tmp_path):
+    '''
+    Takes the server and a temporary directory from pytest as
+    parameters. Checks that the second fetch is answered with 304 and
+    returns the cached copy, and that a changed file is downloaded.
+    '''
+    url = server.url + '/owid.csv'
+    path, digest = final_project_cache.fetch_file(url, str(tmp_path))
+    assert digest == hashlib.sha256(server.files['/owid.csv']).hexdigest()
+    with open(path, 'rb') as file:
+        assert file.read() == server.files['/owid.csv']
+
+    assert final_project_cache.fetch_file(url, str(tmp_path)) == \
+        (path, digest)
+    assert server.codes == [200, 304]
+
+    server.files['/owid.csv'] += b'AFG,2021-01-02\n'
+    new_path, new_digest = final_project_cache.fetch_file(url,
+                                                          str(tmp_path))
+    assert new_digest != digest
+    assert server.codes == [200, 304, 200]
+    with open(new_path, 'rb') as file:
+        assert file.read() == server.files['/owid.csv']
+
+
+def test_fetch_reuses_same_contents(server, tmp_path):
+    '''
+    Takes the server and a temporary directory from pytest as
+    parameters. Checks that two urls with the same contents share one
+    stored copy.
+    '''
+    server.files['/copy.csv'] = server.files['/owid.csv']
+    first = final_project_cache.fetch_file(server.url + '/owid.csv',
+                                           str(tmp_path))
+    second = final_project_cache.fetch_file(server.url + '/copy.csv',
+                                            str(tmp_path))
+    assert first == second
+    assert os.listdir(os.path.join(tmp_path, 'objects')) == \
+        [first[1] + '.csv']
+
+
+def test_fetch_local_file(tmp_path):
+    '''
+    Takes a temporary directory from pytest as a parameter. Checks
+    that a local file is hashed in place, and hashed again only when
+    it changes.
+    '''
+    data_path = str(tmp_path / 'owid.csv')
+    cache_dir = str(tmp_path / 'cache')
+    with open(data_path, 'wb') as file:
+        file.write(b'iso_code,date\nAFG,2021-01-01\n')
+    path, digest = final_project_cache.fetch_file(data_path, cache_dir)
+    assert path == data_path
+    assert final_project_cache.fetch_file(data_path, cache_dir) == \
+        (path, digest)
+
+    with open(data_path, 'ab') as file:
+        file.write(b'AFG,2021-01-02\n')
+    assert final_project_cache.fetch_file(data_path, cache_dir)[1] != digest
+    assert not os.path.exists(os.path.join(cache_dir, 'objects'))
@@ -0,0 +1,235 @@
+'''
+Matthew Friedrich
+CSE 163 Section AG
+
+This file contains tests for the functions in
+final_project_processing_163.py, run with pytest.
+'''
+
+
+import numpy as np
+import pandas as pd
+import final_project_processing_163
+
+
+# countries of the small dataset with their population, including a
+# group of countries and a country under one million people
+FIXTURE_COUNTRIES = {'AFG': 38900000, 'ALB': 2870000, 'BRA': 212500000,
+                     'CAN': 37700000, 'DEU': 83800000, 'ESP': 46700000,
+                     'FRA': 65300000, 'GBR': 67900000, 'IND': 1380000000,
+                     'ISL': 341000, 'JPN': 126500000, 'KEN': 53800000,
+                     'MEX': 128900000, 'NOR': 5420000, 'PER': 32970000,
+                     'OWID_WRL': 7790000000}
+FIXTURE_DAYS = 8
+
+
+def _write_fixture(path):
+    '''
+    Takes path of a CSV file as a parameter. Writes a small dataset
+    with the columns of the COVID-19 dataset, with missing values,
+    countries without people vaccinated on some days, countries whose
+    last days have no vaccinations, a country with no cases and a
+    country never vaccinated. Returns the path.
+    '''
+    rng = np.random.default_rng(163)
+    dates = pd.date_range('2021-01-01', periods=FIXTURE_DAYS)
+    rows = []
+    for number, (iso_code, population) in \
+            enumerate(FIXTURE_COUNTRIES.items()):
+        total = np.cumsum(rng.uniform(0, 0.05, FIXTURE_DAYS)) * population
+        people = total * rng.uniform(0.5, 0.9)
+        # some days missing, or all days after the first ones
+        total[rng.random(FIXTURE_DAYS) < 0.2] = np.nan
+        if number % 4 == 1:
+            total[-2:] = np.nan
+        people[rng.random(FIXTURE_DAYS) < 0.3] = np.nan
+        if iso_code == 'KEN':
+            total[:] = np.nan
+        for day in range(FIXTURE_DAYS):
+            rows.append({
+                'iso_code': iso_code,
+                'continent': np.nan if iso_code == 'OWID_WRL' else 'Asia',
+                'location': 'World' if iso_code == 'OWID_WRL' else iso_code,
+                'date': dates[day].strftime('%Y-%m-%d'),
+                'total_cases': 0 if iso_code == 'PER' else day + 1,
+                'total_vaccinations': total[day],
+                'people_vaccinated': people[day],
+                'people_fully_vaccinated': people[day] / 2,
+                'new_vaccinations': np.nan,
+                'population': population,
+                'gdp_per_capita': np.nan if iso_code == 'ALB'
+                else rng.uniform(1000, 50000)})
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return(path)
+
+
+def _loop_latest_data(filtered_data):
+    '''
+    Takes filtered pandas dataframe as a parameter. Finds the most
+    recent row with vaccinations of each country one country at a
+    time, as get_q3_xy_df did before get_snapshot. Returns pandas
+    dataframe.
+    '''
+    df_3_vacc = filtered_data[filtered_data['total_vaccinations'] != 0]
+    rows = []
+    for country in df_3_vacc['iso_code'].unique():
+        new = df_3_vacc[df_3_vacc['iso_code'] == country]
+        recent_day = new.iloc[[-1]].copy()
+        if (recent_day['people_vaccinated'] == 0).any():
+            recent_day['people_vaccinated'] = recent_day['total_vaccinations']
+        recent_day['percent_vaccinated'] = \
+            (recent_day['people_vaccinated'] / recent_day['population']) * 100
+        rows.append(recent_day)
+    return(pd.concat(rows))
+
+
+def _loop_q1_df(filtered_data):
+    '''
+    Takes filtered pandas dataframe as a parameter. Builds the output
+    of get_q1_df one country at a time, as it did before get_snapshot.
+    Returns pandas dataframe.
+    '''
+    df_relevant = filtered_data[filtered_data['population'] >= 1000000]
+    df_relevant = df_relevant[df_relevant['total_vaccinations'] != 0]
+
+    max_date_df = _loop_latest_data(df_relevant)
+    max_date_df = max_date_df[max_date_df['location'] != 'World']
+    max_date_df = max_date_df[max_date_df['total_cases'] != 0]
+    top_10 = max_date_df.sort_values(by='percent_vaccinated',
+                                     ascending=False).head(10)
+
+    rows = []
+    for country in top_10['iso_code']:
+        new_country = df_relevant[df_relevant['iso_code'] == country].copy()
+        if (new_country['people_vaccinated'] == 0).any():
+            new_country['people_vaccinated'] = \
+                new_country['total_vaccinations']
+        new_country['percent_vaccinated'] = \
+            new_country['people_vaccinated'] / new_country['population'] * 100
+        rows.append(new_country)
+    return(pd.concat(rows))
+
+
+def _assert_same(df, expected):
+    '''
+    Takes pandas dataframe and the dataframe it should match as
+    parameters. Checks that they have the same rows, in the same
+    order and with the same index, and the same columns and values.
+    '''
+    assert list(df.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(df.astype(object),
+                                  expected.astype(object),
+                                  check_dtype=False, check_exact=True)
+
+
+def test_snapshot_matches_loop_code(tmp_path):
+    '''
+    Takes a temporary directory from pytest as a parameter. Checks
+    that get_snapshot, with and without the country index and with
+    each engine, finds the same rows as the old loop over countries.
+    '''
+    path = _write_fixture(str(tmp_path / 'owid.csv'))
+    data = final_project_processing_163.get_filtered_data(path)
+    expected = _loop_latest_data(data)
+
+    country_index = final_project_processing_163.get_country_index(data)
+    _assert_same(final_project_processing_163.get_snapshot(data), expected)
+    _assert_same(final_project_processing_163.get_snapshot(
+        data, country_index), expected)
+    _assert_same(final_project_processing_163.get_snapshot(
+        data, engine='arrow').reset_index(drop=True),
+        expected.reset_index(drop=True))
+    _assert_same(final_project_processing_163.get_q3_xy_df(data),
+                 expected[expected['gdp_per_capita'] != 0])
+
+
+def test_q1_matches_loop_code(tmp_path):
+    '''
+    Takes a temporary directory from pytest as a parameter. Checks
+    that get_q1_df, with and without a shared snapshot and country
+    index, gives the same rows as the old loop over countries.
+    '''
+    path = _write_fixture(str(tmp_path / 'owid.csv'))
+    data = final_project_processing_163.get_filtered_data(path)
+    expected = _loop_q1_df(data)
+    assert expected['iso_code'].nunique() == 10
+
+    country_index = final_project_processing_163.get_country_index(data)
+    snapshot = final_project_processing_163.get_snapshot(data, country_index)
+    _assert_same(final_project_processing_163.get_q1_df(data), expected)
+    _assert_same(final_project_processing_163.get_q1_df(
+        data, snapshot, country_index=country_index), expected)
+
+
+def test_compact_empty_continent_block(tmp_path):
+    '''
+    Takes a temporary directory from pytest as a parameter. Checks
+    that compact mode reads a file long enough to be parsed in several
+    blocks, where the last block has no continent at all, as in the
+    rows of groups of countries at the end of the dataset.
+    '''
+    rows = 200000
+    path = tmp_path / 'owid.csv'
+    df = pd.DataFrame({'iso_code': ['AFG'] * rows + ['OWID_WRL'] * rows,
+                       'continent': ['Asia'] * rows + [np.nan] * rows,
+                       'location': ['Afghanistan'] * rows + ['World'] * rows,
+                       'date': '2021-01-10'})
+    for column in final_project_processing_163.RELEVANT_COLUMNS[4:]:
+        df[column] = 1.0
+    df.to_csv(path, index=False)
+
+    data = final_project_processing_163.get_filtered_data(str(path),
+                                                          compact=True)
+    assert len(data) == 2 * rows
+    assert isinstance(data['continent'].dtype, pd.CategoricalDtype)
+    assert list(data['continent'].cat.categories) == ['Asia']
+    assert data['continent'].isna().sum() == rows
+
+
+def _loop_gdp_data(filtered_data):
+    '''
+    Takes filtered pandas dataframe as a parameter. Takes the highest
+    GDP per capita of each country as get_q3_map_df did before
+    get_gdp_data. Returns pandas dataframe.
+    '''
+    df_3_gdp = filtered_data[['iso_code', 'gdp_per_capita']]
+    df_3_gdp = df_3_gdp.groupby(by='iso_code').max()
+    df_3_gdp.reset_index(inplace=True)
+    return(df_3_gdp)
+
+
+def test_gdp_data_matches_loop_code(tmp_path):
+    '''
+    Takes a temporary directory from pytest as a parameter. Checks
+    that get_gdp_data, from the filtered data, the country index and
+    the country table, gives the same GDP per capita as the old code.
+    '''
+    path = _write_fixture(str(tmp_path / 'owid.csv'))
+    data = final_project_processing_163.get_filtered_data(path)
+    expected = _loop_gdp_data(data)
+
+    country_index = final_project_processing_163.get_country_index(data)
+    country_data = final_project_processing_163.split_country_data(data)[0]
+    _assert_same(final_project_processing_163.get_gdp_data(data), expected)
+    _assert_same(final_project_processing_163.get_gdp_data(
+        data, country_index), expected)
+    _assert_same(final_project_processing_163.get_gdp_data(
+        None, country_data=country_data), expected)
+
+
+def test_stream_matches_loop_code(tmp_path):
+    '''
+    Takes a temporary directory from pytest as a parameter. Checks
+    that stream_country_state, reading a few rows at a time so that
+    countries are split across chunks, finds the same snapshot and
+    GDP per capita as the old code on the whole file.
+    '''
+    path = _write_fixture(str(tmp_path / 'owid.csv'))
+    for compact in [False, True]:
+        data = final_project_processing_163.get_filtered_data(
+            path, compact=compact)
+        state = final_project_processing_163.stream_country_state(
+            path, compact=compact, chunksize=5)
+        _assert_same(state['snapshot'].reset_index(drop=True),
+                     _loop_latest_data(data).reset_index(drop=True))
+        _assert_same(state['gdp_data'], _loop_gdp_data(data))